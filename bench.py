@@ -0,0 +1,341 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import pathlib
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import loguru
+
+import main as qr
+import modules.flex as lex
+import modules.lexpatterns as lp
+from modules.fbench import CorpusSpec, generate_corpus
+from modules.fglob import SourceFile, decode_source
+from modules.fmatch import PatternSet
+from modules.fsink import YamlReportSink, JsonLinesReportSink
+from modules.fwalk import walk
+
+# Marks a directory as a generated corpus, so --corpus never regenerates over anything else
+CORPUS_MARKER: str = ".qrbench.json"
+# The sort of patterns passed with --patterns, matched alongside DEFAULT_PATTERNS to show how matching scales with them
+AD_HOC_PATTERNS: dict[str, str] = {
+    "Hash Usages": r"\b([a-zA-Z]\w*)\.toHashableForm\(\)",
+    "Hashable Type Usages": r"Hashable([A-Za-z]+).from\(([a-zA-Z]+[a-zA-Z0-9\.\_\(\)]*)\)",
+    "Hashcode Generators": r"public int hashCode\(\)",
+    "Equality": r"public boolean equals\(Object \w+\)",
+    "Digests": r"MessageDigest\.getInstance\(\"[\w-]+\"\)",
+    "Ciphers": r"Cipher\.getInstance\(",
+    "Signatures": r"Signature\.getInstance\(",
+    "Key Factories": r"KeyFactory\.getInstance\(",
+    "Random Sources": r"new SecureRandom\(\)",
+    "Exits": r"System\.exit\(\d+\)",
+    "Sleeps": r"Thread\.sleep\(\d+\)",
+    "String Forms": r"public String toString\(\)",
+}
+
+parser = argparse.ArgumentParser(
+    prog='bench.py',
+    description='Generates a deterministic synthetic Java tree and times every stage of QRParse over it, optionally '
+                'saving the timings as a baseline or comparing them against one',
+    epilog='Runs offline, needs nothing but the packages in requirements.txt and pygments')
+
+parser.add_argument('--files', type=int, default=2000, help='Number of source files in the corpus')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--filler-methods', type=int, default=6,
+                    help='Ordinary methods per file, scales the size of every file')
+parser.add_argument('--large-files', type=int, default=4, help='Number of oversized (generated looking) files')
+parser.add_argument('--large-factor', type=int, default=60, help='How many times larger the oversized files are')
+parser.add_argument('--matching', type=float, default=0.6, help='Fraction of files declaring a toHashableForm()')
+parser.add_argument('--corpus', type=str, metavar='DIR',
+                    help='Keep the corpus in this directory and reuse it on later runs with the same spec, '
+                         'rather than generating it into a temporary directory')
+parser.add_argument('--lex-files', type=int, default=200,
+                    help='Number of files put through the (slow) lexing stages')
+parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per stage, the best run counts')
+parser.add_argument('-n', '--number-threads', type=int, default=1,
+                    help='Worker processes for the end to end scan stage')
+parser.add_argument('--stages', type=str, nargs='+', metavar='STAGE', help='Only run these stages')
+parser.add_argument('--save', type=str, metavar='OUT.json', help='Save the timings as a baseline')
+parser.add_argument('--compare', type=str, metavar='BASELINE.json',
+                    help='Compare against a saved baseline, exiting non-zero on any regression')
+parser.add_argument('--threshold', type=float, default=0.10,
+                    help='Slowdown over the baseline, as a fraction, above which a stage counts as regressed')
+
+
+class BenchContext:
+    """
+    The corpus and the intermediate results each stage starts from, so every stage is timed on its own
+    """
+
+    def __init__(self, corpus: pathlib.Path, spec: CorpusSpec, lex_files: int) -> None:
+        self.roots = [corpus / x for x in spec.roots]
+        self.entries = [e for root in self.roots for e in walk(root, ".java")]
+        self.bytes = sum(e.size for e in self.entries)
+        self.pattern_set = PatternSet(qr.DEFAULT_PATTERNS)
+        self.ad_hoc_pattern_set = PatternSet({**qr.DEFAULT_PATTERNS, **AD_HOC_PATTERNS})
+
+        self.sources: list[tuple[str, bytes]] = []
+        for entry in self.entries:
+            with open(entry.path, 'rb') as h:
+                self.sources.append((entry.path, h.read()))
+
+        self.matched: list[qr.JavaFile] = []
+        for path, raw in self.sources:
+            _offsets = self.pattern_set.match(raw)
+            if "Hash Generators" in _offsets:
+                _contents = decode_source(raw)
+                self.matched.append(qr.JavaFile(path, size=len(raw), offsets=_offsets, contents=_contents))
+        self.matched_bytes = sum(jf.size for jf in self.matched)
+
+        self.fields = [qr.ClassInstanceFieldsExtractor(jf) for jf in self.matched]
+        self.values = [qr.RelevantValuesCallExtractor(jf, "Hash Generators") for jf in self.matched]
+        self.report_entries = [(jf.path.parts[len(corpus.parts)], jf.name, str(jf.path),
+                                {"Hash Generators": qr.analyse_file(jf, "Hash Generators")}) for jf in self.matched]
+
+        self.lex_sources = [pathlib.Path(path) for path, _ in self.sources[:lex_files]]
+        self.lex_bytes = sum(os.path.getsize(x) for x in self.lex_sources)
+        self.lexed = [list(lex.LexFile(SourceFile(x)).tokens) for x in self.lex_sources]
+        self.out_dir = pathlib.Path(tempfile.mkdtemp(prefix="qrbench-out-"))
+
+
+def stage_walk(ctx: BenchContext) -> None:
+    for root in ctx.roots:
+        for _ in walk(root, ".java"):
+            pass
+
+
+def stage_read(ctx: BenchContext) -> None:
+    for entry in ctx.entries:
+        with open(entry.path, 'rb') as h:
+            h.read()
+
+
+def stage_match(ctx: BenchContext, pattern_set: PatternSet) -> None:
+    for _, raw in ctx.sources:
+        if pattern_set.match(raw):
+            decode_source(raw)
+
+
+def stage_fields(ctx: BenchContext) -> None:
+    for jf in ctx.matched:
+        qr.ClassInstanceFieldsExtractor(jf)
+
+
+def stage_values(ctx: BenchContext) -> None:
+    for jf in ctx.matched:
+        qr.RelevantValuesCallExtractor(jf, "Hash Generators")
+
+
+def stage_usage(ctx: BenchContext) -> None:
+    for fields, values in zip(ctx.fields, ctx.values):
+        qr.HashGeneratorCheckInstanceFieldUsage(fields, values)
+
+
+def _write_report(ctx: BenchContext, sink) -> None:
+    with sink:
+        for root, name, path, entry in ctx.report_entries:
+            sink.write(root, name, entry, path)
+        for root in ctx.roots:
+            sink.end(root.name)
+
+
+def stage_report_yaml(ctx: BenchContext) -> None:
+    _write_report(ctx, YamlReportSink(str(ctx.out_dir / "report.yml")))
+
+
+def stage_report_jsonl(ctx: BenchContext) -> None:
+    _write_report(ctx, JsonLinesReportSink(str(ctx.out_dir / "report.jsonl")))
+
+
+def stage_lex(ctx: BenchContext) -> None:
+    for path in ctx.lex_sources:
+        for _ in lex.LexFile(SourceFile(path)).tokens:
+            pass
+
+
+def stage_feed(ctx: BenchContext) -> None:
+    _factory = lp.TokenFactory()
+    for tokens in ctx.lexed:
+        for _ in _factory.feed_stream(tokens):
+            pass
+
+
+def stage_dispatch(ctx: BenchContext) -> None:
+    _dispatch = lp.TokenFactory().dispatch
+    for tokens in ctx.lexed:
+        for _type, _ in tokens:
+            _dispatch(_type)
+
+
+def stage_table(ctx: BenchContext) -> None:
+    for tokens in ctx.lexed:
+        lp.TokenTable.from_stream(tokens)
+
+
+def stage_scan(ctx: BenchContext, processes: int) -> None:
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        with qr.ProjectScanner(processes=processes, cache=None) as scanner:
+            scanner.scan(ctx.roots)
+
+
+def stages(ctx: BenchContext, processes: int) -> dict[str, tuple[Callable[[], None], int, int]]:
+    """
+    Stage name -> (run it once, files it processes, bytes it processes)
+    """
+    _all = len(ctx.entries)
+    _matched = len(ctx.matched)
+    return {
+        "walk": (lambda: stage_walk(ctx), _all, ctx.bytes),
+        "read": (lambda: stage_read(ctx), _all, ctx.bytes),
+        "match": (lambda: stage_match(ctx, ctx.pattern_set), _all, ctx.bytes),
+        f"match {len(ctx.ad_hoc_pattern_set.patterns)} patterns": (lambda: stage_match(ctx, ctx.ad_hoc_pattern_set),
+                                                                 _all, ctx.bytes),
+        "instance fields": (lambda: stage_fields(ctx), _matched, ctx.matched_bytes),
+        "relevant values": (lambda: stage_values(ctx), _matched, ctx.matched_bytes),
+        "field usage": (lambda: stage_usage(ctx), _matched, ctx.matched_bytes),
+        "report yaml": (lambda: stage_report_yaml(ctx), _matched, 0),
+        "report jsonl": (lambda: stage_report_jsonl(ctx), _matched, 0),
+        "lex": (lambda: stage_lex(ctx), len(ctx.lex_sources), ctx.lex_bytes),
+        "token feed": (lambda: stage_feed(ctx), len(ctx.lex_sources), ctx.lex_bytes),
+        "token dispatch": (lambda: stage_dispatch(ctx), len(ctx.lex_sources), ctx.lex_bytes),
+        "token table": (lambda: stage_table(ctx), len(ctx.lex_sources), ctx.lex_bytes),
+        "scan": (lambda: stage_scan(ctx, processes), _all, ctx.bytes),
+    }
+
+
+def time_stage(func: Callable[[], None], repeat: int) -> list[float]:
+    _runs = []
+    for _ in range(max(repeat, 1)):
+        _started = time.perf_counter()
+        func()
+        _runs.append(time.perf_counter() - _started)
+    return _runs
+
+
+def prepare_corpus(spec: CorpusSpec, corpus_dir: str | None) -> tuple[pathlib.Path, bool]:
+    """
+    The corpus directory, generating it if needed, and whether it is a temporary one to be removed afterwards
+    """
+    if corpus_dir is None:
+        _dir = pathlib.Path(tempfile.mkdtemp(prefix="qrbench-corpus-"))
+        generate_corpus(_dir, spec)
+        return _dir, True
+
+    _dir = pathlib.Path(corpus_dir)
+    _marker = _dir / CORPUS_MARKER
+    if _marker.exists():
+        if json.loads(_marker.read_text()).get("fingerprint") == spec.fingerprint():
+            return _dir, False
+        shutil.rmtree(_dir)
+    elif _dir.exists() and any(_dir.iterdir()):
+        raise SystemExit(f"{_dir} exists and isn't a benchmark corpus, refusing to generate over it")
+
+    _dir.mkdir(parents=True, exist_ok=True)
+    generate_corpus(_dir, spec)
+    _marker.write_text(json.dumps({"fingerprint": spec.fingerprint(), "spec": spec.as_dict()}))
+    return _dir, False
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Prints each stage against the baseline and returns the names of the stages slower than it by more than `threshold`
+    """
+    if baseline["meta"]["corpus"] != results["meta"]["corpus"]:
+        print("!! Baseline was taken on a different corpus, the comparison is not like for like !!")
+    if baseline["meta"]["python"] != results["meta"]["python"]:
+        print(f"!! Baseline was taken on python {baseline['meta']['python']}, this is {results['meta']['python']} !!")
+
+    _regressed = []
+    print(f"\n{'stage':<18}{'baseline s':>12}{'now s':>12}{'change':>10}")
+    for name, now in results["stages"].items():
+        if name not in baseline["stages"]:
+            print(f"{name:<18}{'-':>12}{now['best']:>12.4f}{'new':>10}")
+            continue
+        _base = baseline["stages"][name]["best"]
+        _change = now["best"] / _base - 1 if _base > 0 else 0.0
+        _flag = ""
+        if _change > threshold:
+            _regressed.append(name)
+            _flag = "  REGRESSED"
+        print(f"{name:<18}{_base:>12.4f}{now['best']:>12.4f}{_change:>+10.1%}{_flag}")
+    return _regressed
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parser.parse_args(argv)
+    loguru.logger.remove()
+    loguru.logger.add(sys.stderr, level="WARNING")
+
+    spec = CorpusSpec(files=args.files, seed=args.seed, filler_methods=args.filler_methods,
+                      large_files=args.large_files, large_factor=args.large_factor, matching=args.matching)
+    _started = time.perf_counter()
+    corpus, temporary = prepare_corpus(spec, args.corpus)
+    print(f"Corpus of {spec.files} files at {corpus} ready in {time.perf_counter() - _started:.2f}s")
+
+    ctx = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            ctx = BenchContext(corpus, spec, args.lex_files)
+        _stages = stages(ctx, args.number_threads)
+        if args.stages:
+            _unknown = set(args.stages) - _stages.keys()
+            if _unknown:
+                raise SystemExit(f"Unknown stages {sorted(_unknown)}, expected some of {list(_stages.keys())}")
+            _stages = {k: v for k, v in _stages.items() if k in args.stages}
+
+        results = {
+            "meta": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "corpus": spec.as_dict(),
+                "lex_files": len(ctx.lex_sources),
+                "repeat": args.repeat,
+                "number_threads": args.number_threads
+            },
+            "stages": {}
+        }
+
+        print(f"\n{'stage':<18}{'files':>8}{'MiB':>9}{'best s':>10}{'median s':>10}{'MiB/s':>9}")
+        for name, (func, files, size) in _stages.items():
+            _runs = time_stage(func, args.repeat)
+            _best = min(_runs)
+            results["stages"][name] = {
+                "best": _best,
+                "median": statistics.median(_runs),
+                "files": files,
+                "bytes": size
+            }
+            _rate = f"{size / 2 ** 20 / _best:>9.1f}" if size and _best > 0 else f"{'-':>9}"
+            print(f"{name:<18}{files:>8}{size / 2 ** 20:>9.2f}{_best:>10.4f}{statistics.median(_runs):>10.4f}{_rate}")
+    finally:
+        if ctx is not None:
+            shutil.rmtree(ctx.out_dir, ignore_errors=True)
+        if temporary:
+            shutil.rmtree(corpus, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as h:
+            json.dump(results, h, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as h:
+            _baseline = json.load(h)
+        _regressed = compare(results, _baseline, args.threshold)
+        if _regressed:
+            print(f"\n{len(_regressed)} stage(s) regressed by more than {args.threshold:.0%}: {', '.join(_regressed)}")
+            return 1
+        print(f"\nNo stage regressed by more than {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,38 @@
-import datetime
 import sys
-import time
 
 # import logging
 import loguru
+import mmap
 import multiprocessing
-from multiprocessing import Manager
 # from queue import Queue
 import os
 import yaml
 import pathlib
 import argparse
+import functools
 import re
-from typing import Generator, Iterable, Any
+import time
+from typing import Generator, Iterable, Self
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+from modules.farchive import is_archive, walk_archive, split_member, read_member, read_source, remove_spools
+from modules.fbudget import BUDGET, RegexBudgetExceeded, DEFAULT_REGEX_BUDGET, HARD_LIMIT_GRACE
+from modules.fcache import ScanCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES, fingerprint
+from modules.fglob import decode_source
+from modules.fmatch import PatternSet, warn_backtracking, DEFAULT_MMAP_THRESHOLD
+from modules.fprof import PROFILER, DEFAULT_KEEP_SLOWEST
+from modules.fpipe import BoundedPipeline, ReorderBuffer, INFLIGHT_PER_WORKER
+from modules.fsched import (available_cpus, pack_by_size, WorkerUtilisation, SCHEDULES, DEFAULT_CHUNK_BYTES,
+                            DEFAULT_LOOKAHEAD)
+from modules.fsink import ReportSink, TeeReportSink, open_report_sink, REPORT_FORMATS
+from modules.fstore import ResultStoreSink
+from modules.fwalk import walk, WalkEntry, DEFAULT_EXCLUDES, DEFAULT_BUILD_OUTPUTS
+
 load_dotenv()
 # This is default because im the best and everyone uses F drive surely
-EVOTING_PATH: pathlib.Path = pathlib.Path(os.environ["EVOTING_PATH"])
+EVOTING_PATH: pathlib.Path | None = pathlib.Path(os.environ["EVOTING_PATH"]) if "EVOTING_PATH" in os.environ.keys() \
+    else None
 TARGET_SOURCE_EXTENSION: str = ".java" if "TARGET_SOURCE_EXTENSION" not in os.environ.keys() \
     else os.environ["TARGET_SOURCE_EXTENSION"]
 
@@ -28,16 +42,58 @@ parser = argparse.ArgumentParser(
                 'looking for specified regexes and patterns',
     epilog='ALPHA version 1.0.0rc1')
 
-parser.add_argument('-p', '--path', type=str)
+parser.add_argument('-p', '--path', type=str,
+                    help='The project to scan, a directory or a source archive (zip, jar, tar, tar.gz, ...), instead '
+                         'of the roots configured in the environment')
 parser.add_argument('-t', '--type', type=str)
-parser.add_argument('-n', '--number-threads', type=int, default=8)
+parser.add_argument('-n', '--number-threads', type=int, default=available_cpus(),
+                    help='Worker processes, defaults to the number of CPUs this process may run on')
+parser.add_argument('--chunk-size', type=int, default=16,
+                    help='Maximum number of files handed to a worker per dispatch')
+parser.add_argument('--chunk-bytes', type=int, default=DEFAULT_CHUNK_BYTES,
+                    help='With --schedule size, close a chunk once it holds this many bytes of source')
+parser.add_argument('--mmap-threshold', type=int, default=DEFAULT_MMAP_THRESHOLD, metavar='BYTES',
+                    help='Memory map files of at least this many bytes rather than reading them into memory, and '
+                         'decode them a window at a time if they have to be decoded to be matched (0 to never map)')
+parser.add_argument('--schedule', type=str, choices=SCHEDULES, default='size',
+                    help='size: scan the largest of every --lookahead walked files first, in byte-balanced chunks; '
+                         'walk: scan in walk order while walking')
+parser.add_argument('--lookahead', type=int, default=DEFAULT_LOOKAHEAD, metavar='FILES',
+                    help='With --schedule size, how many walked files are sorted by size at a time')
 parser.add_argument('-o', '--out', type=str)
+parser.add_argument('--format', type=str, choices=REPORT_FORMATS, default='yaml',
+                    help='Report format written to --out')
+parser.add_argument('--db', type=str, metavar='PATH',
+                    help='Also record the results in this SQLite result store, see python -m modules.fstore')
 parser.add_argument('-v', '--verbose',
                     action='store_true')  # on/off flag
 parser.add_argument('-l', '--list',
                     action='store_true')
 parser.add_argument('--patterns', metavar='R', type=str, nargs='+',
                     help='The regex patterns to look for, appended to default')
+parser.add_argument('--exclude', metavar='GLOB', type=str, nargs='+', default=[],
+                    help='Directory or file globs to skip while walking, on top of the default build/VCS excludes')
+parser.add_argument('--no-default-excludes', action='store_true',
+                    help='Walk into build output and VCS directories too')
+parser.add_argument('--gitignore', action='store_true',
+                    help='Skip anything ignored by .gitignore files in the walked trees')
+parser.add_argument('--regex-budget', type=float, default=DEFAULT_REGEX_BUDGET, metavar='SECONDS',
+                    help='Give up on a pattern that runs for longer than this against a single file, and kill '
+                         'workers that stop responding altogether (0 to never give up)')
+parser.add_argument('--loose-field-match', action='store_true',
+                    help='Count a field as used if its name appears anywhere inside a call argument '
+                         '(the old substring behaviour), rather than only as a whole identifier')
+parser.add_argument('--no-cache', action='store_true',
+                    help='Scan every file, without reading or writing the scan cache')
+parser.add_argument('--rebuild-cache', action='store_true',
+                    help='Discard the scan cache and rebuild it from this run')
+parser.add_argument('--cache-dir', type=str, default=str(DEFAULT_CACHE_DIR))
+parser.add_argument('--profile', type=str, metavar='OUT.json',
+                    help='Time every stage of the run, in the workers too, and write the figures out as JSON')
+parser.add_argument('--profile-slowest', type=int, default=DEFAULT_KEEP_SLOWEST, metavar='N',
+                    help='Number of slowest files kept per stage with --profile')
+parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_ENTRIES,
+                    help='Maximum number of files kept in the scan cache')
 
 DEFAULT_PATTERNS: dict = {
     "Hash Generators": r" toHashableForm\(\) {",  # r"public List<(.*)> toHashableForm\(\)",
@@ -57,105 +113,508 @@ SUB_PATTERNS: dict = {
     ]
 }
 
+# The relevance types that get a field usage report, these are analysed by the scan workers as soon as they match
+REPORTED_RELEVANCE_TYPES: tuple[str, ...] = ("Hash Generators",)
+
 INSTANCE_FIELD_MATCH = r"private(final | )? ([^;]+);"
 RECORD_CONS_FIELD_MATCH = r"([\S]+ [a-zA-Z_]+)(,|$|\))"
+# A type declaration at the start of a line, optionally behind annotations, e.g. "@Foo public final class Bar"
+CLASS_HEADER_MATCH = r"^[ \t]*(?:@[\w.]+(?:\([^)\n]*\))?\s+)*" \
+                     r"(?P<modifiers>(?:(?:public|protected|private|abstract|final|static|sealed|non-sealed|strictfp)\s+)*)" \
+                     r"(?P<kind>class|record|interface|enum)\s+(?P<name>[A-Za-z_$][\w$]*)"
+CLASS_CLAUSE_MATCH = r"\b(extends|implements|permits)\s"
+IDENTIFIER_MATCH = r"[A-Za-z_$][\w$]*"
+# Accessor prefixes stripped off call arguments so that getFoo() counts as a use of the field foo
+GETTER_PREFIXES: tuple[str, ...] = ("get", "is")
 TEMP_LOCAL_MODIFICATION_MATCH = r"final ([\S]+)(<[^=]+>) ([\S]+) = ([\S]+)\.([^;]+);"
+PACKAGE_MATCH = r"^\s*package\s+([\w.]+)\s*;"
+
+# Bump whenever the analysis changes in a way the patterns alone don't capture, so cached results are recomputed
+ANALYSIS_VERSION: int = 5
+
+
+def pattern_fingerprint(loose_field_match: bool = False) -> str:
+    """
+    Identifies the pattern set and analysis that a cached scan result was produced by
+    """
+    return fingerprint(ANALYSIS_VERSION, DEFAULT_PATTERNS, SUB_PATTERNS,
+                       INSTANCE_FIELD_MATCH, RECORD_CONS_FIELD_MATCH, TEMP_LOCAL_MODIFICATION_MATCH,
+                       CLASS_HEADER_MATCH, CLASS_CLAUSE_MATCH, IDENTIFIER_MATCH, GETTER_PREFIXES, PACKAGE_MATCH,
+                       loose_field_match)
 
 
 class JavaFile:
     """
-    An object representing a JavaFile, containing the file path, name and contents
+    An object representing a JavaFile, containing the file path, name, size, the offsets of any pattern matches and,
+    for matching files, the declared package, along with any report entries already computed for it.
+    The contents are only read from disk on first access, and are never pickled, so a JavaFile stays cheap to pass
+    between processes and to hold onto in RelevantFiles.MATCHES
     """
 
-    def __init__(self, path: pathlib.Path):
-        self.path = path
-        self.name = path.name
-        with open(self.path, 'r', encoding='utf-8') as f:
-            self.contents = f.read()
+    def __init__(self,
+                 path: str | pathlib.Path,
+                 size: int | None = None,
+                 offsets: dict[str, tuple[int, int]] | None = None,
+                 contents: str | None = None,
+                 mtime_ns: int | None = None):
+        self.path = pathlib.Path(path)
+        self.name = self.path.name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.offsets: dict[str, tuple[int, int]] = {} if offsets is None else offsets
+        self.reports: dict[str, dict] = {}
+        self.package: str | None = None
+        # Why scanning this file was cut short, if it was. Such files are never cached.
+        self.budget_exceeded: str | None = None
+        self._contents: str | None = contents
+
+    @classmethod
+    def from_cache(cls, path: pathlib.Path, size: int, mtime_ns: int, payload: dict) -> Self:
+        jf = cls(path, size=size, mtime_ns=mtime_ns,
+                 offsets={k: tuple(v) for k, v in payload["offsets"].items()})
+        jf.reports = payload["reports"]
+        jf.package = payload["package"]
+        return jf
+
+    def cache_payload(self) -> dict:
+        return {
+            "offsets": self.offsets,
+            "reports": self.reports,
+            "package": self.package
+        }
+
+    @property
+    def qualified_name(self) -> str:
+        """
+        package.Class, or just the class name for a file in the default package (or one that hasn't been scanned)
+        """
+        _stem = self.name.split(".")[0]
+        return _stem if self.package is None else f"{self.package}.{_stem}"
+
+    @property
+    def contents(self) -> str:
+        if self._contents is None:
+            self._contents = decode_source(read_source(self.path))
+        return self._contents
+
+    def unload(self) -> None:
+        """
+        Drops the cached contents, they are read again if anything asks for them
+        """
+        self._contents = None
+
+    def __getstate__(self) -> dict:
+        _state = self.__dict__.copy()
+        _state["_contents"] = None
+        return _state
 
 
 class JavaFileLoader:
     """
-    An iterable object of Java files globbed from the given directory and all subdirectories based on file extension.
+    An iterable object of Java files walked from the given directory and all subdirectories based on file extension,
+    yielded as WalkEntry's carrying the path, size and mtime of each file.
     By default, we look for '.java' file extensions, but this can be overriden with the `--type` command-line argument,
     or with the TARGET_SOURCE_EXTENSION environment variable (use a .env file)
+    Directories matching `excludes` (VCS metadata and generated sources by default) are never walked into, nor are
+    `build_outputs` directories that sit beside a build file.
+    A source archive is read in place, its members yielded with archive!/member paths.
     """
 
-    def __init__(self, project_path: str) -> None:
+    def __init__(self,
+                 project_path: str,
+                 excludes: Iterable[str] = DEFAULT_EXCLUDES,
+                 gitignore: bool = False,
+                 build_outputs: Iterable[str] = DEFAULT_BUILD_OUTPUTS) -> None:
         self.path = pathlib.Path(project_path)
         self.depleted: bool = False
-        self.files: Generator = self.path.glob(f"**/*{TARGET_SOURCE_EXTENSION}")
+        if is_archive(self.path):
+            self.files: Generator = walk_archive(self.path, TARGET_SOURCE_EXTENSION, excludes=excludes)
+        else:
+            self.files = walk(self.path, TARGET_SOURCE_EXTENSION, excludes=excludes, gitignore=gitignore,
+                              build_outputs=build_outputs)
         self.current_idx: int = 0
 
     def __iter__(self):
         return self
 
-    def __next__(self) -> JavaFile:
-        return JavaFile(self.files.__next__())
+    def __next__(self) -> WalkEntry:
+        return self.files.__next__()
 
 
 class RelevantFiles:
     """
-    An object containing an iterable of JavaFile's that contain the desired regex patterns
+    An object containing an iterable of JavaFile's that contain the desired regex patterns, for a single project root.
+    Filled in by a ProjectScanner, which may be scanning several roots at once.
     """
     MATCHES: dict[str, list[JavaFile]] = None
 
-    def __init__(self, jf_iterable: Iterable[JavaFile], path: pathlib.Path) -> None:
-        """
-        We multiprocess the file globbing and parsing as complex regex's can be inefficient to compute, especially over
-        large numbers of files (such as the e-voting source dir)
-        """
-        self.POOL = multiprocessing.Pool(processes=args.number_threads)
+    def __init__(self, path: pathlib.Path, patterns: dict[str, str] | None = None) -> None:
+        if patterns is None:
+            patterns = DEFAULT_PATTERNS
         self.MATCHES = {}
         self.num_matches: int = 0
         self.num_files: int = 0
 
         self.path = path
 
-        manager = Manager()
-        result_queue = manager.Queue()
-        for pat_ in DEFAULT_PATTERNS.keys():
+        for pat_ in patterns.keys():
             self.MATCHES[pat_] = []
 
-        print("Spinning up globbing engine...")
-        for jf in tqdm(jf_iterable, ncols=60, colour='blue', desc='Globbing and Matching...'):
-            self.POOL.apply(func=mp_parse_file, args=(jf, result_queue,))
-            self.num_files += 1
-
-        # Pull from the multiprocessing result queue to extract the computed dicts of each process invocation,
-        # merge dict lists into main matches dict.
-        while not result_queue.empty():
-            _res: dict[str, list[JavaFile]] = result_queue.get()
-            for rkey in _res.keys():
-                self.MATCHES[rkey].extend(_res[rkey])
-
-        for _tk in self.MATCHES.keys():
-            self.num_matches += len(self.MATCHES[_tk])
-
+    def add(self, jf: JavaFile) -> None:
+        """
+        Records a scanned file, files are expected to be added in this root's walk order
+        """
+        self.num_files += 1
+        for rkey in jf.offsets.keys():
+            self.MATCHES[rkey].append(jf)
+            self.num_matches += 1
 
+    def finalise(self) -> None:
         loguru.logger.success(f"{self.path.name}: "
                               f"Found {self.num_matches} matching files out of {self.num_files} total.")
 
 
-def mp_parse_file(jf: JavaFile, _rq: Any) -> None:
+class ProjectScanner:
     """
-    This is the multiprocessing target that the multiprocessing pool points the workers at,
-    _rq is a result queue (from Manager().Queue()) that the output is stored in upon completion
+    Owns the worker pool that every project root is scanned through, so that one long-lived pool serves the whole run.
     """
-    # time.sleep(0.1)
-    _matches = {}
-    for p_key in DEFAULT_PATTERNS.keys():
-        pattern = DEFAULT_PATTERNS[p_key]
 
-        _test = re.search(pattern, jf.contents)
-        if not _test:
-            continue
+    def __init__(self,
+                 processes: int | None = None,
+                 chunk_size: int = 16,
+                 chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                 schedule: str = "size",
+                 lookahead: int = DEFAULT_LOOKAHEAD,
+                 patterns: dict[str, str] | None = None,
+                 cache: ScanCache | None = None,
+                 excludes: Iterable[str] = DEFAULT_EXCLUDES,
+                 gitignore: bool = False,
+                 build_outputs: Iterable[str] = DEFAULT_BUILD_OUTPUTS,
+                 analyse: Iterable[str] = REPORTED_RELEVANCE_TYPES,
+                 loose_field_match: bool = False,
+                 regex_budget: float | None = DEFAULT_REGEX_BUDGET,
+                 mmap_threshold: int | None = DEFAULT_MMAP_THRESHOLD) -> None:
+        """
+        `processes` workers (every available CPU by default, 1 to match in-process) get at most `chunk_size` paths at a
+        time; the "size" `schedule` sorts every `lookahead` walked files largest first into chunks of ~`chunk_bytes`.
+        Workers match `patterns` (DEFAULT_PATTERNS by default), analyse the `analyse` relevance types, give up on a
+        regex after `regex_budget` seconds and map files of `mmap_threshold` bytes or more. `cache` carries results
+        across runs; `excludes`, `gitignore` and `build_outputs` prune the walk.
+        """
+        self.analyse = tuple(analyse)
+        self.loose_field_match = loose_field_match
+        self.patterns = DEFAULT_PATTERNS if patterns is None else patterns
+        self.chunk_size = max(chunk_size, 1)
+        self.chunk_bytes = max(chunk_bytes, 1)
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule {schedule}, expected one of {SCHEDULES}")
+        self.schedule = schedule
+        self.lookahead = max(lookahead, 1)
+        self.processes = available_cpus() if processes is None else max(processes, 1)
+        self.regex_budget = regex_budget or None
+        self.mmap_threshold = mmap_threshold or None
+        # How long one file may take before its worker is presumed wedged, every regex budget plus some grace
+        self.hard_limit: float | None = None
+        if self.regex_budget is not None:
+            _patterns = len(self.patterns) + sum(len(SUB_PATTERNS.get(x, ())) for x in self.analyse)
+            self.hard_limit = self.regex_budget * _patterns + HARD_LIMIT_GRACE
+        warn_backtracking(self.patterns)
+        warn_backtracking({x: SUB_PATTERNS[x] for x in self.analyse if x in SUB_PATTERNS})
+        self.cache = cache
+        self.excludes = tuple(excludes)
+        self.gitignore = gitignore
+        self.build_outputs = tuple(build_outputs)
+        self.pool = None
+        self.max_inflight = 1
+        # Set once a task has been given up on, the pool still counts it as outstanding and would wait on it forever
+        self.abandoned_tasks: bool = False
+        _profile_slowest = PROFILER.keep_slowest if PROFILER.enabled else None
+        if self.processes > 1:
+            self.pool = multiprocessing.Pool(processes=self.processes, initializer=mp_init_worker,
+                                             initargs=(self.patterns, self.analyse, self.loose_field_match,
+                                                       _profile_slowest, self.regex_budget, self.hard_limit,
+                                                       self.mmap_threshold))
+            self.max_inflight = self.processes * INFLIGHT_PER_WORKER
+        else:
+            # No watchdog in-process, it would take the whole run down with it
+            mp_init_worker(self.patterns, self.analyse, self.loose_field_match, _profile_slowest, self.regex_budget,
+                           mmap_threshold=self.mmap_threshold)
 
-        if p_key not in _matches.keys():
-            _matches[p_key] = []
+    def __enter__(self) -> Self:
+        return self
 
-        _matches[p_key].append(jf)
-    _rq.put(_matches)
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.pool is not None:
+            if self.abandoned_tasks:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+        remove_spools()
+
+    def scan(self, roots: list[pathlib.Path]) -> list[RelevantFiles]:
+        """
+        Scans every root in one go and returns one RelevantFiles per root in the same order as `roots`
+        """
+        _relevant = [RelevantFiles(root, self.patterns) for root in roots]
+        for root_idx, jf in self.stream(roots):
+            if jf is None:
+                _relevant[root_idx].finalise()
+            else:
+                _relevant[root_idx].add(jf)
+        return _relevant
+
+    def stream(self, roots: list[pathlib.Path]) -> Generator[tuple[int, JavaFile | None], None, None]:
+        """
+        Scans every root, the files of all roots interleaved into a single work queue, and yields (root index, JavaFile)
+        for each file as soon as it and every file walked before it in the same root have been scanned. Once a root has
+        no files left, (root index, None) is yielded.
+        The walk only runs ahead of the workers by a bounded number of chunks, so memory stays flat on any size of
+        tree. The "size" schedule also holds on to up to `lookahead` walk entries, and to results that finish ahead of
+        files walked before them, in exchange for not leaving a huge file until last.
+        Per-worker utilisation, and how many files ran over the regex budget, are logged at the end.
+        """
+        _order: list[ReorderBuffer[JavaFile]] = [ReorderBuffer() for _ in roots]
+        _walked: list[int | None] = [None] * len(roots)
+        _emitted: list[int] = [0] * len(roots)
+        _timeout = None if self.hard_limit is None else lambda chunk: self.hard_limit * len(chunk)
+        _chunk: list[tuple[int, int, str, int, int]] = []
+        _pending: list[tuple[int, int, str, int, int]] = []
+        _utilisation = WorkerUtilisation()
+        _cut_short: list[str] = []
+        _progress = tqdm(ncols=60, colour='blue', desc='Globbing and Matching...')
+
+        def _release(root_idx: int, idx: int, jf: JavaFile) -> Generator[tuple[int, JavaFile | None], None, None]:
+            for _ready in _order[root_idx].push(idx, jf):
+                _emitted[root_idx] += 1
+                _progress.update()
+                yield root_idx, _ready
+            if _emitted[root_idx] == _walked[root_idx]:
+                yield root_idx, None
+
+        def _collect(result: tuple[int, float, list[tuple[int, int, JavaFile]], dict | None]) \
+                -> Generator[tuple[int, JavaFile | None], None, None]:
+            _pid, _busy, _chunk_result, _profile = result
+            PROFILER.merge(_profile)
+            _utilisation.record(_pid, _busy, len(_chunk_result), sum(x[2].size for x in _chunk_result))
+            for root_idx, idx, jf in _chunk_result:
+                if jf.budget_exceeded is not None:
+                    _cut_short.append(jf.path)
+                    loguru.logger.warning(f"Cut short scanning {jf.path}: {jf.budget_exceeded}")
+                elif self.cache is not None:
+                    self.cache.put(str(jf.path), jf.size, jf.mtime_ns, jf.cache_payload())
+                yield from _release(root_idx, idx, jf)
+
+        def _expire(chunk: list[tuple[int, int, str, int, int]]) -> Generator[tuple[int, JavaFile | None], None, None]:
+            if len(chunk) > 1:
+                # Can't tell which of the files wedged the worker, so give each of them another go on its own
+                for _item in chunk:
+                    yield from _pipeline.submit([_item])
+                return
+            root_idx, idx, path, size, mtime_ns = chunk[0]
+            jf = JavaFile(path, size=size, mtime_ns=mtime_ns)
+            jf.budget_exceeded = f"worker stopped responding for {self.hard_limit}s and was killed"
+            _cut_short.append(path)
+            loguru.logger.error(f"Gave up on {path}: {jf.budget_exceeded}")
+            yield from _release(root_idx, idx, jf)
+
+        def _submit_by_size(items: list[tuple[int, int, str, int, int]]) \
+                -> Generator[tuple[int, JavaFile | None], None, None]:
+            for _sized_chunk in pack_by_size(items, lambda x: x[3], self.chunk_size, self.chunk_bytes):
+                yield from _pipeline.submit(_sized_chunk)
+                yield from _pipeline.poll()
+
+        _pipeline: BoundedPipeline[tuple[int, JavaFile | None]] = \
+            BoundedPipeline(self.pool, mp_parse_chunk, self.max_inflight, _collect, _expire,
+                            workers=self.processes, timeout=_timeout)
+
+        print("Spinning up globbing engine...")
+        try:
+            for root_idx, idx, entry in self._interleave(roots):
+                if entry is None:
+                    # This root's walk is done, idx is its file count
+                    _walked[root_idx] = idx
+                    if _emitted[root_idx] == idx:
+                        yield root_idx, None
+                    continue
+
+                _cached = None
+                if self.cache is not None:
+                    with PROFILER.stage("cache lookup", entry.path, entry.size):
+                        _cached = self.cache.get(entry.path, entry.size, entry.mtime_ns)
+                if _cached is not None:
+                    yield from _release(root_idx, idx,
+                                        JavaFile.from_cache(entry.path, entry.size, entry.mtime_ns, _cached))
+                    continue
+
+                _item = (root_idx, idx, entry.path, entry.size, entry.mtime_ns)
+                if self.schedule == "size":
+                    _pending.append(_item)
+                    if len(_pending) >= self.lookahead:
+                        yield from _submit_by_size(_pending)
+                        _pending = []
+                    continue
+
+                _chunk.append(_item)
+                if len(_chunk) >= self.chunk_size:
+                    yield from _pipeline.submit(_chunk)
+                    _chunk = []
+                yield from _pipeline.poll()
+
+            if _chunk:
+                yield from _pipeline.submit(_chunk)
+            yield from _submit_by_size(_pending)
+            yield from _pipeline.drain()
+        finally:
+            # Whether the scan finished or was left early, close() has to know if the pool lost track of a task
+            self.abandoned_tasks |= _pipeline.abandoned
+        _progress.close()
+        _utilisation.log(self.processes)
+        if _cut_short:
+            loguru.logger.warning(f"{len(_cut_short)} files were cut short by the regex budget, their reports are "
+                                  f"incomplete and they will be scanned again next run")
+
+    def _interleave(self, roots: list[pathlib.Path]) -> Generator[tuple[int, int, WalkEntry | None], None, None]:
+        """
+        Round-robins over the file loaders of every root, yielding (root index, index within root, walk entry), and
+        (root index, number of files, None) when a root's walk is finished
+        """
+        _loaders = [(root_idx, enumerate(JavaFileLoader(str(root), excludes=self.excludes, gitignore=self.gitignore,
+                                                        build_outputs=self.build_outputs)))
+                    for root_idx, root in enumerate(roots)]
+        _counts = [0] * len(roots)
+        while _loaders:
+            for _loader in list(_loaders):
+                root_idx, loader = _loader
+                try:
+                    with PROFILER.stage("walk"):
+                        idx, entry = next(loader)
+                except StopIteration:
+                    _loaders.remove(_loader)
+                    yield root_idx, _counts[root_idx], None
+                    continue
+                _counts[root_idx] += 1
+                yield root_idx, idx, entry
+
+
+_PATTERN_SET: PatternSet | None = None
+_ANALYSE: tuple[str, ...] = ()
+_LOOSE_FIELD_MATCH: bool = False
+_WATCHDOG: float | None = None
+_MMAP_THRESHOLD: int | None = None
+
+
+def mp_init_worker(patterns: dict[str, str],
+                   analyse: tuple[str, ...] = (),
+                   loose_field_match: bool = False,
+                   profile_slowest: int | None = None,
+                   regex_budget: float | None = None,
+                   watchdog: float | None = None,
+                   mmap_threshold: int | None = None) -> None:
+    """
+    Pool initializer, compiles the pattern set once per worker process rather than once per file, and records which
+    relevance types the worker should analyse matching files for, and how. Profiling is switched on in the worker if
+    `profile_slowest` is given. Every regex is held to `regex_budget` seconds, and with a `watchdog` the worker kills
+    itself if a single file ever takes longer than that. Files of at least `mmap_threshold` bytes are memory mapped.
+    """
+    global _PATTERN_SET, _ANALYSE, _LOOSE_FIELD_MATCH, _WATCHDOG, _MMAP_THRESHOLD
+    _PATTERN_SET = PatternSet(patterns)
+    _ANALYSE = analyse
+    _LOOSE_FIELD_MATCH = loose_field_match
+    _WATCHDOG = watchdog
+    _MMAP_THRESHOLD = mmap_threshold
+    BUDGET.enable(regex_budget)
+    if profile_slowest is not None and not PROFILER.enabled:
+        PROFILER.enable(profile_slowest)
+
+
+def _map_source(path: str) -> mmap.mmap | bytes:
+    """
+    A read-only memory map of the file at `path`, or its bytes if it can't be mapped because it is empty
+    """
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return f.read()
+
+
+def mp_parse_file(item: tuple[int, int, str, int, int]) -> tuple[int, int, JavaFile]:
+    """
+    This is the multiprocessing target that the multiprocessing pool points the workers at.
+    Takes a (root index, index, path, size, mtime) tuple, reads the file and hands back the root and file indexes
+    alongside a JavaFile record carrying the offsets of the first match of every pattern in the worker's pattern set
+    that the file matched, and the report entry for every relevance type the worker analyses that it matched.
+    The file is matched as raw bytes, only files with some pattern's literal in them are decoded. Large files are
+    mapped rather than read, so a large file that doesn't match is never held in memory. Archive members are read out
+    of their archive.
+    """
+    root_idx, idx, path, size, mtime_ns = item
+    if _WATCHDOG is not None:
+        BUDGET.watchdog(_WATCHDOG)
+    _raw: bytes | mmap.mmap = b""
+    try:
+        with PROFILER.stage("read", path, size):
+            if split_member(path) is not None:
+                _raw = read_member(path)
+            elif _MMAP_THRESHOLD is not None and size >= _MMAP_THRESHOLD:
+                _raw = _map_source(path)
+            else:
+                with open(path, 'rb') as f:
+                    _raw = f.read()
+
+        _timed_out: list[str] = []
+        with PROFILER.stage("match", path, size):
+            _offsets = _PATTERN_SET.match(_raw, timed_out=_timed_out)
+        # Only the patterns that ran over budget are missing, whatever the others matched still stands
+        _budget_exceeded = f"{', '.join(_timed_out)} ran for longer than the {BUDGET.seconds}s budget, " \
+                           f"not matched" if _timed_out else None
+
+        if not _offsets:
+            # The vast majority of files, never decoded
+            jf = JavaFile(path, size=size, offsets=_offsets, mtime_ns=mtime_ns)
+            jf.budget_exceeded = _budget_exceeded
+            return root_idx, idx, jf
+
+        with PROFILER.stage("decode", path, size):
+            _contents = decode_source(_raw)
+        jf = JavaFile(path, size=size, offsets=_offsets, mtime_ns=mtime_ns, contents=_contents)
+        jf.budget_exceeded = _budget_exceeded
+        _package = _PACKAGE_RE.search(_contents)
+        jf.package = _package.group(1) if _package else None
+        for relevance_type in _ANALYSE:
+            if relevance_type in _offsets:
+                try:
+                    with PROFILER.stage("analyse", path, size):
+                        jf.reports[relevance_type] = analyse_file(jf, relevance_type,
+                                                                  loose_field_match=_LOOSE_FIELD_MATCH)
+                except RegexBudgetExceeded as e:
+                    _note = f"{e}, not analysed for {relevance_type}"
+                    jf.budget_exceeded = _note if jf.budget_exceeded is None else f"{jf.budget_exceeded}; {_note}"
+                    jf.reports[relevance_type] = budget_exceeded_entry(jf, str(e))
+        jf.unload()
+        return root_idx, idx, jf
+    finally:
+        if isinstance(_raw, mmap.mmap):
+            _raw.close()
+        if _WATCHDOG is not None:
+            BUDGET.watchdog(None)
+
+
+def mp_parse_chunk(chunk: list[tuple[int, int, str, int, int]]) \
+        -> tuple[int, float, list[tuple[int, int, JavaFile]], dict | None]:
+    """
+    Runs mp_parse_file over a batch of files, so the pool is dispatched to once per chunk rather than once per file.
+    Returns the worker's pid, how long it spent on the chunk and its profile since the last chunk (None unless
+    profiling) alongside the results.
+    """
+    _started = time.perf_counter()
+    _results = [mp_parse_file(x) for x in chunk]
+    return os.getpid(), time.perf_counter() - _started, _results, PROFILER.drain()
 
 
 class RelevantValuesCallExtractor:
@@ -171,8 +630,9 @@ class RelevantValuesCallExtractor:
         self.extracted: list[str] = []
         self.full_str: str = "!! unable to extract !!"
         self.multiple_matches: bool = False
-        for reg in self.extractor_regexes:
-            _result = re.findall(reg, self.file.contents)
+        for reg_idx, reg in enumerate(self.extractor_regexes):
+            with BUDGET.guard(f"SUB_PATTERNS[{relevance_type!r}][{reg_idx}]"):
+                _result = re.findall(reg, self.file.contents)
 
             if _result:
                 if len(_result) > 1:
@@ -180,11 +640,120 @@ class RelevantValuesCallExtractor:
                 for res in _result:
                     self.extracted.append(str(res).strip().replace("\n", "").replace("\t", ""))
 
-                _full_str_match = re.search(reg, self.file.contents)
+                with BUDGET.guard(f"SUB_PATTERNS[{relevance_type!r}][{reg_idx}]"):
+                    _full_str_match = re.search(reg, self.file.contents)
                 self.full_str = _full_str_match.group().replace("\n", "").replace("\t", "").strip()
 
 
+_CLASS_HEADER_RE: re.Pattern = re.compile(CLASS_HEADER_MATCH, re.MULTILINE)
+_CLASS_CLAUSE_RE: re.Pattern = re.compile(CLASS_CLAUSE_MATCH)
+_INSTANCE_FIELD_RE: re.Pattern = re.compile(INSTANCE_FIELD_MATCH)
+_RECORD_CONS_FIELD_RE: re.Pattern = re.compile(RECORD_CONS_FIELD_MATCH)
+_PACKAGE_RE: re.Pattern = re.compile(PACKAGE_MATCH, re.MULTILINE)
+
+
+class ClassHeader:
+    """
+    The outermost type declaration of a source file, as offsets into the file contents.
+    Spans are (start, end) pairs, None where the declaration has no such part.
+    """
+
+    def __init__(self, contents: str, match: re.Match) -> None:
+        self.contents = contents
+        self.start: int = match.start("modifiers")
+        self.kind: str = match.group("kind")
+        self.name_span: tuple[int, int] = match.span("name")
+        self.modifiers: tuple[str, ...] = tuple(match.group("modifiers").split())
+        self.generics_span: tuple[int, int] | None = None
+        self.components_span: tuple[int, int] | None = None
+        self.extends_span: tuple[int, int] | None = None
+        self.implements_span: tuple[int, int] | None = None
+        self.body_span: tuple[int, int] | None = None
+        self.has_static_builder: bool = False
+
+    def text(self, span: tuple[int, int] | None) -> str | None:
+        return None if span is None else self.contents[span[0]:span[1]]
+
+    @property
+    def name(self) -> str:
+        return self.text(self.name_span)
+
+
+def _closing(contents: str, start: int, opening: str, closing: str) -> int:
+    """
+    The offset of the bracket closing the one at `start`, -1 if it is never closed
+    """
+    _depth = 0
+    for idx in range(start, len(contents)):
+        _c = contents[idx]
+        if _c == opening:
+            _depth += 1
+        elif _c == closing:
+            _depth -= 1
+            if _depth == 0:
+                return idx
+    return -1
+
+
+def _skip_whitespace(contents: str, idx: int) -> int:
+    while idx < len(contents) and contents[idx].isspace():
+        idx += 1
+    return idx
+
+
+def scan_class_header(contents: str) -> ClassHeader | None:
+    """
+    Finds the first type declaration in the file and reads its header in a single pass: the kind, name and
+    modifiers, type parameters, record components, extends/implements clauses and the span of the body.
+    Nested types come after their enclosing type, so the first declaration is the file's top level one.
+    """
+    _match = _CLASS_HEADER_RE.search(contents)
+    if _match is None:
+        return None
+
+    header = ClassHeader(contents, _match)
+    idx = _skip_whitespace(contents, _match.end())
+    if idx < len(contents) and contents[idx] == "<":
+        _end = _closing(contents, idx, "<", ">")
+        if _end == -1:
+            return None
+        header.generics_span = (idx, _end + 1)
+        idx = _skip_whitespace(contents, _end + 1)
+
+    if header.kind == "record" and idx < len(contents) and contents[idx] == "(":
+        _end = _closing(contents, idx, "(", ")")
+        if _end == -1:
+            return None
+        header.components_span = (idx + 1, _end)
+        idx = _end + 1
+
+    _body_start = contents.find("{", idx)
+    if _body_start == -1:
+        return None
+
+    # extends/implements/permits clauses run up to the next clause keyword, or the opening brace
+    _clauses = [(m.group(1), m.start(), m.end()) for m in _CLASS_CLAUSE_RE.finditer(contents, idx, _body_start)]
+    for _i, (keyword, _kw_start, _kw_end) in enumerate(_clauses):
+        _clause_end = _clauses[_i + 1][1] if _i + 1 < len(_clauses) else _body_start
+        while _clause_end > _kw_end and contents[_clause_end - 1].isspace():
+            _clause_end -= 1
+        if keyword == "extends":
+            header.extends_span = (_kw_end, _clause_end)
+        elif keyword == "implements":
+            header.implements_span = (_kw_end, _clause_end)
+
+    # The outermost type's body closes with the last brace in the file
+    header.body_span = (_body_start, contents.rfind("}") + 1)
+    header.has_static_builder = contents.find("public static class Builder", _body_start) != -1
+    return header
+
+
 class ClassInstanceFieldsExtractor:
+    """
+    Extracts the instance fields of the file's class: the record components for records, otherwise every private
+    field declared between the class header and the first constructor.
+    """
+
     def __init__(self, jf: JavaFile) -> None:
         self.file = jf
         self.is_record = False
@@ -194,83 +763,105 @@ class ClassInstanceFieldsExtractor:
         self.implements: None | str = None
         self.extends: None | str = None
         self.values: list[tuple] = []
-        try:
-            if "public class" in self.file.contents:
-                _search_str = "public class"
-                _class_def_start: int = self.file.contents.index(_search_str)
-            elif "public final class" in self.file.contents:
-                _search_str = "public final class"
-                _class_def_start: int = self.file.contents.index(_search_str)
-            elif "public abstract class" in self.file.contents:
-                self.is_abstract = True
-                _search_str = "public abstract class"
-                _class_def_start: int = self.file.contents.index(_search_str)
-            elif "public record" in self.file.contents:
-                self.is_record = True
-                _search_str = "public record"
-                _class_def_start: int = self.file.contents.index(_search_str)
-            else:
-                print(f"Cant find a class or record def in {self.file.name}.")
-                raise ValueError(f"Cant find a class or record def in {self.file.name}.")
+        self.header: ClassHeader | None = scan_class_header(self.file.contents)
+        if self.header is None:
+            print(f"Cant find a class or record def in {self.file.name}.")
+            return
+
+        _header = self.header
+        self.is_record = _header.kind == "record"
+        self.is_final = "final" in _header.modifiers
+        self.is_abstract = "abstract" in _header.modifiers
+        self.has_static_builder = _header.has_static_builder
+        self.implements = _header.text(_header.implements_span)
+        self.extends = _header.text(_header.extends_span)
+
+        if self.is_record:
+            if _header.components_span is not None:
+                # Include the closing parenthesis, the last component is terminated by it
+                self.values = _RECORD_CONS_FIELD_RE.findall(self.file.contents,
+                                                            _header.components_span[0],
+                                                            _header.components_span[1] + 1)
+            return
+
+        _class_def_end = self._fields_end()
+        if _class_def_end == -1:
+            print(f"Could not find the end of the field declarations in {self.file.name}...")
+            return
+        self.values = _INSTANCE_FIELD_RE.findall(self.file.contents, _header.start, _class_def_end)
+
+    def _fields_end(self) -> int:
+        """
+        Fields are taken to end at the first constructor, or the first abstract method of an abstract class
+        """
+        _header = self.header
+        if self.is_abstract:
+            return self.file.contents.find("public abstract", _header.start)
+
+        if self.has_static_builder:
+            _constructor = f"private {_header.name}("
+        elif "public" in _header.modifiers:
+            _constructor = f"public {_header.name}("
+        else:
+            _constructor = f"{_header.name}("
+        return self.file.contents.find(_constructor, _header.body_span[0])
 
-            _class_def_name: str = self.file.contents[_class_def_start + len(_search_str):]
-            _class_def_name = _class_def_name.strip()
 
-            if "implements" in self.file.contents:
-                self.implements = self.file.contents.split("implements ")[1].split("{")[0].strip()
+_IDENTIFIER_RE: re.Pattern = re.compile(IDENTIFIER_MATCH)
 
-            if "extends" in self.file.contents:
-                self.extends = self.file.contents.split("extends ")[1].strip().split()[0]
 
-            if "public static class Builder" in self.file.contents:
-                self.has_static_builder = True
+class ExtractedIdentifierIndex:
+    """
+    The identifiers appearing in a set of extracted call arguments, tokenised once and lower-cased into a set so that
+    checking whether a field is passed in is a single lookup. Accessor calls are indexed under the field name they
+    read as well, i.e. getElectionEventId() also indexes electioneventid.
+    """
 
-            if self.is_record:
-                _class_def_name = _class_def_name.split("(")[0]
-                _class_def_end = self.file.contents.index(f"public {_class_def_name} {{")
-            elif self.is_abstract:
-                _class_def_name = _class_def_name.split()[0]
-                _class_def_end = self.file.contents.index(f"public abstract")
-            else:
-                _class_def_name = _class_def_name.split()[0]
-                if self.has_static_builder:
-                    _class_def_end = self.file.contents.index(f"private {_class_def_name}(")
-                else:
-                    _class_def_end = self.file.contents.index(f"public {_class_def_name}(")
-
-            # print(f"Class def starts at {_class_def_start}, ends at {_class_def_end} and has name {_class_def_name} ")
-            if self.is_record:
-                _sub_contents: str = self.file.contents[_class_def_start:_class_def_end].split(f"{_class_def_name}(")[1].split("{")[0]
-                if self.implements:
-                    _sub_contents = _sub_contents.split("implements")[0]
-                matches = re.findall(RECORD_CONS_FIELD_MATCH, _sub_contents)
-                if matches:
-                    self.values = matches
-                    # print(matches)
-            else:
-                _sub_contents: str = self.file.contents[_class_def_start:_class_def_end]
-                matches = re.findall(INSTANCE_FIELD_MATCH, _sub_contents)
-                if matches:
-                    self.values = matches
-                    # print(matches)
+    def __init__(self, extracted: list[str]) -> None:
+        self.extracted = extracted
+        self.identifiers: set[str] = set()
+        self._lowered: list[str] | None = None
+
+        for _arg in extracted:
+            for _ident in _IDENTIFIER_RE.findall(_arg):
+                _lower = _ident.lower()
+                self.identifiers.add(_lower)
+                for _prefix in GETTER_PREFIXES:
+                    if len(_ident) > len(_prefix) and _ident.startswith(_prefix) and _ident[len(_prefix)].isupper():
+                        self.identifiers.add(_lower[len(_prefix):])
 
-        except ValueError as e:
-            print(f"Could not string manipulate file {self.file.name}...")
-            print(e)
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self.identifiers
+
+    def contains_substring(self, name: str) -> bool:
+        """
+        Whether the name appears anywhere in the extracted arguments, even inside a longer identifier
+        """
+        if self._lowered is None:
+            self._lowered = [x.lower() for x in self.extracted]
+        _name = name.lower()
+        return any(_name in x for x in self._lowered)
 
 
 class HashGeneratorCheckInstanceFieldUsage:
+    """
+    Sorts the class instance fields into those that are passed to the relevant call and those that aren't.
+    By default a field only counts as used if it appears as a whole identifier (or through its getter), with
+    `loose` any substring of the call arguments counts, which was the original behaviour.
+    """
     USED: list[str] = None
     UNUSED: list[str] = None
 
     def __init__(self,
                  cife: ClassInstanceFieldsExtractor,
                  rvce: RelevantValuesCallExtractor,
+                 loose: bool = False,
                  ) -> None:
         self.USED = []
         self.UNUSED = []
         self._cife = cife
         self.parsed_values = []
+        _index = ExtractedIdentifierIndex(rvce.extracted)
 
         for _cif in cife.values:
 
@@ -279,153 +870,261 @@ class HashGeneratorCheckInstanceFieldUsage:
             self.parsed_values.append(_name)
             if _name == "signature":
                 continue
-            if any([_name.lower() in x.lower() for x in rvce.extracted]):
+            if _name in _index or (loose and _index.contains_substring(_name)):
                 self.USED.append(_name)
             else:
-                if any([_name.lower() in x.lower() for x in rvce.extracted]):
-                    self.USED.append(_name)
-                else:
-                    self.UNUSED.append(_name)
+                self.UNUSED.append(_name)
 
     def log(self) -> None:
-        loguru.logger.success(f"REPORT: {self._cife.file.name} results")
-        if self.UNUSED:
-            loguru.logger.error(f"The following class instance fields were found to not be used in the Hash Generator:")
-            for _un in self.UNUSED:
-                loguru.logger.warning(f" - {_un}")
-        else:
-            loguru.logger.success(f"All class instance fields were found in the Hash Generator declaration.")
+        log_field_usage(self._cife.file.name, self.UNUSED)
+
+
+def log_field_usage(file_name: str, unused: list[str]) -> None:
+    loguru.logger.success(f"REPORT: {file_name} results")
+    if unused:
+        loguru.logger.error(f"The following class instance fields were found to not be used in the Hash Generator:")
+        for _un in unused:
+            loguru.logger.warning(f" - {_un}")
+    else:
+        loguru.logger.success(f"All class instance fields were found in the Hash Generator declaration.")
+
+
+def analyse_file(jf: JavaFile, relevance_type: str, loose_field_match: bool = False) -> dict:
+    """
+    The per-file field usage analysis: extracts the class instance fields and the values passed to the relevance
+    type's call, checks one against the other (allowing for fields aliased through a temporary local) and returns the
+    report entry as a plain dict. Safe to run in a worker process.
+    """
+    with PROFILER.stage("instance fields", str(jf.path)):
+        _fields = ClassInstanceFieldsExtractor(jf)
+    with PROFILER.stage("relevant values", str(jf.path)):
+        _matches = RelevantValuesCallExtractor(jf, relevance_type)
+    with PROFILER.stage("field usage", str(jf.path)):
+        _usage = HashGeneratorCheckInstanceFieldUsage(_fields, _matches, loose=loose_field_match)
+
+    if _usage.UNUSED:
+        to_remove = None
+        full_str = _fields.file.contents.split("toHashableForm()")[1].split("}")[0]
+        _match = re.search(TEMP_LOCAL_MODIFICATION_MATCH, full_str)
+        if _match:
+            _g = _match.group()
+            for possible_unused in _usage.UNUSED:
+                if possible_unused in _g:
+                    loguru.logger.info(f"Found instance field alias: {possible_unused} becomes "
+                                       f"{_g.split('=')[0].strip().split()[-1]} in {_fields.file.name}")
+                    _usage.USED.append(possible_unused)
+                    to_remove = possible_unused
+
+            if to_remove is not None:
+                _usage.UNUSED.remove(to_remove)
+
+    _entry = {
+        "matched string": _matches.full_str,
+        "instance fields": _usage.parsed_values,
+        "used": _usage.USED,
+        "unused": _usage.UNUSED
+    }
+
+    if _matches.multiple_matches:
+        _entry["special notes"] = [
+            f"multiple matches for pattern regex found in file, check specifics of definition manually. "
+            f"(file://{_matches.file.path})"
+        ]
+    return _entry
+
+
+def budget_exceeded_entry(jf: JavaFile, reason: str) -> dict:
+    """
+    The report entry standing in for a file whose analysis was abandoned
+    """
+    return {
+        "matched string": "!! unable to extract !!",
+        "instance fields": [],
+        "used": [],
+        "unused": [],
+        "special notes": [f"analysis abandoned, {reason}, check manually. (file://{jf.path})"]
+    }
 
 
 class ClassInstanceFieldUsageReport:
+    """
+    Collects the field usage entries of one root and hands each file's entries to the sink as soon as the file is
+    done, so only the file currently being reported on is ever held in REPORT.
+    """
 
     REPORT: dict[str, dict]
-    HGCIFU: HashGeneratorCheckInstanceFieldUsage | None
 
-    def __init__(self, dir_name: str) -> None:
+    def __init__(self,
+                 dir_name: str,
+                 sink: ReportSink | None = None,
+                 cache: ScanCache | None = None,
+                 loose_field_match: bool = False) -> None:
         self.REPORT = {}
-        self.HGCIFU = None
         self.dir = dir_name
+        self.sink = sink if sink is not None else ReportSink()
+        self.cache = cache
+        self.loose_field_match = loose_field_match
+        self._written: set[str] = set()
+        self._paths: dict[str, str] = {}
+        self.sink.begin(self.dir)
 
     def report(self, jf: JavaFile, relevance_type: str) -> None:
+        if jf.name in self._written:
+            return
         if jf.name in self.REPORT.keys():
             if relevance_type in self.REPORT[jf.name].keys():
                 return
         else:
             self.REPORT[jf.name] = {}
+            self._paths[jf.name] = str(jf.path)
+
+        if relevance_type in jf.reports:
+            # Analysed by the scan worker, or on a previous run and the file hasn't changed since
+            self.REPORT[jf.name][relevance_type] = jf.reports[relevance_type]
+            return
+
+        with PROFILER.stage("analyse", str(jf.path), jf.size):
+            self.REPORT[jf.name][relevance_type] = analyse_file(jf, relevance_type,
+                                                                loose_field_match=self.loose_field_match)
+        jf.reports[relevance_type] = self.REPORT[jf.name][relevance_type]
+        if self.cache is not None and jf.mtime_ns is not None:
+            self.cache.put(str(jf.path), jf.size, jf.mtime_ns, jf.cache_payload())
+
+    def log(self, jf: JavaFile, relevance_type: str) -> None:
+        _entry = self.REPORT.get(jf.name, {}).get(relevance_type)
+        if _entry is not None:
+            log_field_usage(jf.name, _entry["unused"])
+
+    def flush(self) -> None:
+        """
+        Writes out every entry reported since the last flush. A file name is only ever written once per root.
+        """
+        for name, entry in self.REPORT.items():
+            with PROFILER.stage("report", self._paths[name]):
+                self.sink.write(self.dir, name, entry, self._paths[name])
+            self._written.add(name)
+        self.REPORT = {}
+        self._paths = {}
+
+    def send_out(self) -> None:
+        self.flush()
+        with PROFILER.stage("report"):
+            self.sink.end(self.dir)
 
-        _fields = ClassInstanceFieldsExtractor(jf)
-        _matches = RelevantValuesCallExtractor(jf, relevance_type)
-        self.HGCIFU = HashGeneratorCheckInstanceFieldUsage(_fields, _matches)
-
-        if self.HGCIFU.UNUSED:
-            to_remove = None
-            full_str = _fields.file.contents.split("toHashableForm()")[1].split("}")[0]
-            _match = re.search(TEMP_LOCAL_MODIFICATION_MATCH, full_str)
-            if _match:
-                _g = _match.group()
-                for possible_unused in self.HGCIFU.UNUSED:
-                    if possible_unused in _g:
-                        loguru.logger.info(f"Found instance field alias: {possible_unused} becomes "
-                                           f"{_g.split('=')[0].strip().split()[-1]} in {_fields.file.name}")
-                        self.HGCIFU.USED.append(possible_unused)
-                        to_remove = possible_unused
-
-                if to_remove is not None:
-                    self.HGCIFU.UNUSED.remove(to_remove)
-
-        self.REPORT[jf.name][relevance_type] = {
-            "matched string": _matches.full_str,
-            "instance fields": self.HGCIFU.parsed_values,
-            "used": self.HGCIFU.USED,
-            "unused": self.HGCIFU.UNUSED
-        }
 
-        if _matches.multiple_matches:
-            self.REPORT[jf.name][relevance_type]["special notes"] = [
-                f"multiple matches for pattern regex found in file, check specifics of definition manually. "
-                f"(file://{_matches.file.path})"
-            ]
+# Which section of the verification mapping each project root is checked against
+VERIFICATION_MAPPING_KEYS: dict[str, str] = {
+    "e-voting": "domain",
+    "crypto-primitives-domain": "crypto-primitives-domain",
+    "crypto-primitives": "crypto-primitives",
+    "verifier": "verifier-protocol"
+}
 
-    def send_out(self, fp: str, append_mode: bool = True) -> None:
-        _sout = sys.stdout
-        _serr = sys.stderr
 
-        _out = {
-            "stdout": _sout,
-            "serr": _serr
-        }
+class VerificationResult:
+    """
+    The outcome of checking one root's matching files against the classes the mapping expects for it
+    """
 
-        try:
-            _output = _out[fp]
-        except KeyError:
-            _output = fp
+    def __init__(self, reader: str, expected: int, found: int, missing: list[str], unexpected: list[str]) -> None:
+        self.reader = reader
+        self.expected = expected
+        self.found = found
+        self.missing = missing
+        self.unexpected = unexpected
 
-        handle = open(_output, 'a' if append_mode else 'w') if _output == fp else _output
-        handle.write(f"# ----- BEGIN {self.dir} REPORT ------\n")
-        yaml.safe_dump(self.REPORT, handle)
-        handle.write(f"# ----- END {self.dir} REPORT ------\n\n")
-        if handle is not (sys.stdout or sys.stderr):
-            handle.close()
+    @property
+    def ok(self) -> bool:
+        return not self.missing and not self.unexpected
+
+    def log(self) -> None:
+        for _expected in self.missing:
+            loguru.logger.warning(f"Did not find {_expected} in output, "
+                                  f"but expected to find it for this reader: {self.reader}")
+
+        for _found in self.unexpected:
+            loguru.logger.warning(f"Found {_found} in output, "
+                                  f"but did not expect to find it for this reader: {self.reader}")
+        loguru.logger.info(f"Verif stats:")
+        loguru.logger.info(f"Found Files / Expected Files => {self.found} / {self.expected}")
+
+
+def _compile_mapping(packages: dict, out: dict[str, str]) -> None:
+    for package, item in packages.items():
+        if type(item) is list:
+            for name in item:
+                out[f"{package}.{name}"] = name
+        elif type(item) is dict:
+            _compile_mapping(item, out)
+
+
+@functools.lru_cache(maxsize=None)
+def load_verification_mapping(mapping_path: str) -> dict[str, dict[str, str]] | None:
+    """
+    The verification mapping at `mapping_path` compiled into a package.Class -> Class dict per reader, read once per
+    process and path. None if the file can't be opened.
+    """
+    try:
+        with open(mapping_path, 'r') as h:
+            _mapping: dict = yaml.safe_load(h)
+    except OSError:
+        print(f"could not open {mapping_path}, there will be no verification")
+        return None
 
-        # print(_matches.extracted)
-        # print(self.REPORT)
+    _expected = {}
+    for reader_key, packages in _mapping.items():
+        _expected[reader_key] = {}
+        _compile_mapping(packages or {}, _expected[reader_key])
+    return _expected
 
 
 class EffectivityVerifier:
-    def __init__(self):
-        try:
-            with open('data/verif-mapping.yml', 'r') as h:
-                self.mapping: dict = yaml.safe_load(h)
-        except OSError:
-            print("could not open data/verif-mapping.yml, there will be no verification")
-            self.mapping = None
-
-    def verify_relevant_files(self, active_reader: str, relevant_files: dict[str, list[JavaFile]]) -> bool:
-        if self.mapping is None:
+    """
+    Checks the files found for a root against a verification mapping (data/verif-mapping.yml by default), so a
+    verification is a handful of set differences.
+    """
+
+    def __init__(self, mapping_path: str = 'data/verif-mapping.yml') -> None:
+        self.expected: dict[str, dict[str, str]] | None = load_verification_mapping(mapping_path)
+
+    def verify_relevant_files(self,
+                              active_reader: str,
+                              relevant_files: dict[str, list[JavaFile]]) -> VerificationResult | None:
+        """
+        Files that declare a package are checked by package.Class, files in the default package by class name alone.
+        Returns None if there is nothing to verify against.
+        """
+        if self.expected is None:
             print("Mapping is none, no data file found! Nothing to verify.")
-            return False
-        _map_ar_to_data_key: dict = {
-            "e-voting": "domain",
-            "crypto-primitives-domain": "crypto-primitives-domain",
-            "crypto-primitives": "crypto-primitives",
-            "verifier": "verifier-protocol"
-        }
-        _relevant_dict: dict | None = self.mapping[_map_ar_to_data_key[active_reader]]
-        _files = []
-        while _relevant_dict is not None:
-            _replacement_dict: dict | None = None
-            for item in _relevant_dict.values():
-                if type(item) is list:
-                    _files.extend(item)
-                elif type(item) is dict:
-                    if _replacement_dict is None:
-                        _replacement_dict = item
-                    else:
-                        _replacement_dict = _replacement_dict | item
-            _relevant_dict = _replacement_dict
-
-        _relevant_files = []
-        for _rfk in relevant_files.keys():
-            _relevant_files.extend([x.name.split(".")[0] for x in relevant_files[_rfk]])
-
-        for _expected in _files:
-            if _expected not in _relevant_files:
-                loguru.logger.warning(f"Did not find {_expected} in output, "
-                                      f"but expected to find it for this reader: {active_reader}")
-
-        for _found in _relevant_files:
-            if _found not in _files:
-                loguru.logger.warning(f"Found {_found} in output, "
-                                      f"but did not expect to find it for this reader: {active_reader}")
-        loguru.logger.info(f"Verif stats:")
-        loguru.logger.info(f"Found Files / Expected Files => {len(_relevant_files)} / {len(_files)}")
+            return None
+        if VERIFICATION_MAPPING_KEYS.get(active_reader) not in self.expected:
+            loguru.logger.warning(f"No verification mapping for reader: {active_reader}")
+            return None
+
+        _expected = self.expected[VERIFICATION_MAPPING_KEYS[active_reader]]
+        _expected_names = set(_expected.values())
+
+        _found = [jf for _rfk in relevant_files.keys() for jf in relevant_files[_rfk]]
+        _found_qualified = {jf.qualified_name for jf in _found if jf.package is not None}
+        _found_unpackaged = {jf.qualified_name for jf in _found if jf.package is None}
+        _unexpected = _found_qualified - _expected.keys()
+        _unexpected |= _found_unpackaged - _expected_names
+        _missing = {x for x in _expected.keys() - _found_qualified if _expected[x] not in _found_unpackaged}
+
+        _result = VerificationResult(active_reader,
+                                     expected=len(_expected),
+                                     found=len(_found),
+                                     missing=sorted(_missing),
+                                     unexpected=sorted(_unexpected))
+        _result.log()
+        return _result
 
 
 class QRParseWrapper:
     def __init__(self, args_) -> None:
         self.args = args_
         self.paths: list[pathlib.Path] = []
+        self.verifier = EffectivityVerifier()
 
     def get_paths_from_env(self) -> None:
         try:
@@ -438,41 +1137,83 @@ class QRParseWrapper:
             raise e
 
     def exec(self):
-        if os.path.exists(args.out) and args.out.endswith(".yml"):
-            os.remove(args.out)
-
-        with open(args.out, "w") as h:
-            h.write(f"# ----- BEGIN QRPARSE TEST {datetime.datetime.now()} ------\n")
-
-        for path in self.paths:
-
-            _verifier = EffectivityVerifier()
-            _relevant = RelevantFiles(JavaFileLoader(str(path)), path)
-            # print(f"Hey! Found {_relevant.num_matches} matches.")
-            _CIFUR = ClassInstanceFieldUsageReport(path.name)
-
-            for hash_gen in _relevant.MATCHES["Hash Generators"]:
-                _CIFUR.report(hash_gen, "Hash Generators")
-
-                if self.args.verbose and _CIFUR.HGCIFU:
-                    _CIFUR.HGCIFU.log()
-
-            _verifier.verify_relevant_files(path.name, _relevant.MATCHES)
-            print(f"Cooling down processing pool...")
-            time.sleep(0.1)
-            if self.args.out:
-                _CIFUR.send_out(args.out)
+        if self.args.profile:
+            PROFILER.enable(self.args.profile_slowest)
+
+        _cache = None
+        if not self.args.no_cache:
+            _cache = ScanCache(self.args.cache_dir, pattern_fingerprint(self.args.loose_field_match),
+                               max_entries=self.args.cache_size,
+                               rebuild=self.args.rebuild_cache)
+
+        _excludes = list(self.args.exclude)
+        if not self.args.no_default_excludes:
+            _excludes.extend(DEFAULT_EXCLUDES)
+
+        _relevant = [RelevantFiles(path, DEFAULT_PATTERNS) for path in self.paths]
+        _sink = open_report_sink(self.args.out, self.args.format)
+        if self.args.db:
+            _sink = TeeReportSink([_sink, ResultStoreSink(self.args.db)])
+        _reports = [ClassInstanceFieldUsageReport(path.name, sink=_sink, cache=_cache,
+                                                  loose_field_match=self.args.loose_field_match)
+                    for path in self.paths]
+        # Roots can finish scanning in any order, but are written out in the order they were given in
+        _finished: ReorderBuffer[int] = ReorderBuffer()
 
+        try:
+            with _sink, ProjectScanner(processes=self.args.number_threads,
+                                       chunk_size=self.args.chunk_size,
+                                       chunk_bytes=self.args.chunk_bytes,
+                                       schedule=self.args.schedule,
+                                       lookahead=self.args.lookahead,
+                                       patterns=DEFAULT_PATTERNS,
+                                       cache=_cache,
+                                       excludes=_excludes,
+                                       gitignore=self.args.gitignore,
+                                       build_outputs=() if self.args.no_default_excludes else DEFAULT_BUILD_OUTPUTS,
+                                       analyse=REPORTED_RELEVANCE_TYPES,
+                                       loose_field_match=self.args.loose_field_match,
+                                       regex_budget=self.args.regex_budget,
+                                       mmap_threshold=self.args.mmap_threshold) as scanner:
+                for root_idx, jf in scanner.stream(self.paths):
+                    if jf is None:
+                        for _done in _finished.push(root_idx, root_idx):
+                            self.finish_root(_relevant[_done], _reports[_done])
+                        continue
+
+                    _relevant[root_idx].add(jf)
+                    for relevance_type in REPORTED_RELEVANCE_TYPES:
+                        if relevance_type not in jf.offsets:
+                            continue
+                        _reports[root_idx].report(jf, relevance_type)
+                        jf.unload()
+
+                        if self.args.verbose:
+                            _reports[root_idx].log(jf, relevance_type)
+                    _reports[root_idx].flush()
+        finally:
+            # Whatever was scanned before a failure is still worth keeping
+            if _cache is not None:
+                _cache.close()
+        if self.args.profile:
+            PROFILER.dump(self.args.profile)
+
+    def finish_root(self, relevant: RelevantFiles, cifur: ClassInstanceFieldUsageReport) -> None:
+        relevant.finalise()
+        with PROFILER.stage("verify"):
+            self.verifier.verify_relevant_files(relevant.path.name, relevant.MATCHES)
+        cifur.send_out()
 
-args = parser.parse_args()
 
 if __name__ == "__main__":
+    args = parser.parse_args()
+
     if args.list:
         print(yaml.safe_dump(DEFAULT_PATTERNS))
         sys.exit(0)
 
     if args.path is None:
-        print(f"<< No path provided with --path < path >, defaulting to EVOTING_PATH environment variable. >>")
+        print(f"<< No path provided with --path < path >, defaulting to the project roots in the environment. >>")
 
     if args.patterns:
         print(f"<< Additional anonymous patterns provided with --patterns, temp inserting into defaults... >>")
@@ -488,6 +1229,9 @@ if __name__ == "__main__":
         print("!! This may result in unusual and unexpected globbing behaviour, proceed with caution.   !!")
 
     wrapper = QRParseWrapper(args)
-    wrapper.get_paths_from_env()
+    if args.path is None:
+        wrapper.get_paths_from_env()
+    else:
+        wrapper.paths.append(pathlib.Path(args.path))
     wrapper.exec()
 
@@ -0,0 +1,236 @@
+import collections
+import hashlib
+import os
+import pathlib
+import posixpath
+import tarfile
+import tempfile
+import zipfile
+from typing import Generator, Iterable
+
+import loguru
+
+from modules.fwalk import WalkEntry, DEFAULT_EXCLUDES, compile_globs
+
+# Separates an archive from the path of a member within it, as in jar: URLs
+ARCHIVE_SEPARATOR: str = "!/"
+
+ZIP_SUFFIXES: tuple[str, ...] = (".zip", ".jar", ".war", ".ear")
+TAR_SUFFIXES: tuple[str, ...] = (".tar",)
+COMPRESSED_TAR_SUFFIXES: tuple[str, ...] = (".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ARCHIVE_SUFFIXES: tuple[str, ...] = ZIP_SUFFIXES + TAR_SUFFIXES + COMPRESSED_TAR_SUFFIXES
+
+# Archives each process keeps open for reading members out of
+MAX_OPEN_ARCHIVES: int = 8
+
+
+def archive_kind(path: str | pathlib.Path) -> str | None:
+    """
+    "zip", "tar" or "compressed tar" going by the name of `path`, None if it doesn't look like an archive
+    """
+    _name = os.fspath(path).lower()
+    if _name.endswith(ZIP_SUFFIXES):
+        return "zip"
+    if _name.endswith(TAR_SUFFIXES):
+        return "tar"
+    if _name.endswith(COMPRESSED_TAR_SUFFIXES):
+        return "compressed tar"
+    return None
+
+
+def is_archive(path: str | pathlib.Path) -> bool:
+    return archive_kind(path) is not None and os.path.isfile(path)
+
+
+def member_path(archive: str | pathlib.Path, member: str) -> str:
+    return f"{os.fspath(archive)}{ARCHIVE_SEPARATOR}{member}"
+
+
+def split_member(path: str | pathlib.Path) -> tuple[str, str] | None:
+    """
+    (archive, member) for an archive!/member path, None for a plain path
+    """
+    _path = os.fspath(path)
+    _idx = _path.find(ARCHIVE_SEPARATOR)
+    while _idx != -1:
+        if archive_kind(_path[:_idx]) is not None:
+            return _path[:_idx], _path[_idx + len(ARCHIVE_SEPARATOR):]
+        _idx = _path.find(ARCHIVE_SEPARATOR, _idx + 1)
+    return None
+
+
+class _ZipReader:
+    """
+    Reads members out of a zip (or jar), through its central directory
+    """
+
+    def __init__(self, path: str) -> None:
+        self.zip = zipfile.ZipFile(path)
+
+    def members(self) -> Generator[tuple[str, int], None, None]:
+        for info in self.zip.infolist():
+            if not info.is_dir():
+                yield info.filename, info.file_size
+
+    def read(self, member: str) -> bytes:
+        return self.zip.read(member)
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+class _TarReader:
+    """
+    Reads members out of an uncompressed tar, straight from their data offsets, so that any member can be read without
+    going through the ones before it. Member names are normalised (no leading ./).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # name -> (data offset, size)
+        self.index: dict[str, tuple[int, int]] = {}
+        with tarfile.open(path, "r:") as tar:
+            for info in tar:
+                if info.isfile():
+                    self.index[posixpath.normpath(info.name)] = (info.offset_data, info.size)
+
+    def members(self) -> Generator[tuple[str, int], None, None]:
+        for name, (_, size) in self.index.items():
+            yield name, size
+
+    def read(self, member: str) -> bytes:
+        _offset, _size = self.index[member]
+        with open(self.path, "rb") as f:
+            f.seek(_offset)
+            return f.read(_size)
+
+    def close(self) -> None:
+        pass
+
+
+# Spools of compressed tars created by this process, removed by remove_spools
+_SPOOLS: list[str] = []
+# archive -> ((size, mtime), reader), least recently used first
+_READERS: collections.OrderedDict[str, tuple[tuple[int, int], _ZipReader | _TarReader]] = collections.OrderedDict()
+
+
+def _spool_path(archive: str, stat: os.stat_result) -> str:
+    _key = f"{os.path.abspath(archive)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")
+    return os.path.join(tempfile.gettempdir(), f"qrparse-{hashlib.sha1(_key).hexdigest()[:16]}.tar")
+
+
+def _ensure_spool(archive: str, stat: os.stat_result) -> str:
+    """
+    A compressed tar can only be read from front to back, so it is decompressed once, its regular files copied into an
+    uncompressed tar in the temp directory, named after the archive's path, size and mtime so that every process
+    reading from the same archive finds the same spool
+    """
+    _spool = _spool_path(archive, stat)
+    if os.path.exists(_spool):
+        return _spool
+
+    loguru.logger.debug(f"Decompressing {archive} to {_spool}")
+    _fd, _partial = tempfile.mkstemp(prefix="qrparse-", suffix=".part")
+    try:
+        with os.fdopen(_fd, "wb") as out, tarfile.open(archive, "r|*") as src, \
+                tarfile.open(fileobj=out, mode="w|") as dst:
+            for info in src:
+                if info.isfile():
+                    dst.addfile(info, src.extractfile(info))
+        os.replace(_partial, _spool)
+    except BaseException:
+        os.unlink(_partial)
+        raise
+    _SPOOLS.append(_spool)
+    return _spool
+
+
+def _reader(archive: str) -> _ZipReader | _TarReader:
+    _stat = os.stat(archive)
+    _key = (_stat.st_size, _stat.st_mtime_ns)
+    _cached = _READERS.get(archive)
+    if _cached is not None:
+        if _cached[0] == _key:
+            _READERS.move_to_end(archive)
+            return _cached[1]
+        # Changed since it was opened
+        _cached[1].close()
+        del _READERS[archive]
+
+    _kind = archive_kind(archive)
+    if _kind == "zip":
+        _opened = _ZipReader(archive)
+    elif _kind == "tar":
+        _opened = _TarReader(archive)
+    else:
+        _opened = _TarReader(_ensure_spool(archive, _stat))
+    _READERS[archive] = (_key, _opened)
+    while len(_READERS) > MAX_OPEN_ARCHIVES:
+        _READERS.popitem(last=False)[1][1].close()
+    return _opened
+
+
+def _excluded(exclude, member: str) -> bool:
+    _parts = member.split("/")
+    for idx, _part in enumerate(_parts):
+        if exclude.match(_part) or exclude.match("/".join(_parts[:idx + 1])):
+            return True
+    return False
+
+
+def walk_archive(archive: str | pathlib.Path,
+                 extension: str,
+                 excludes: Iterable[str] = DEFAULT_EXCLUDES) -> Generator[WalkEntry, None, None]:
+    """
+    Yields a WalkEntry for every member of `archive` whose name ends with `extension`, in archive order, with an
+    archive!/member path, the member's size and the archive's mtime (so that cached results for the members are dropped
+    whenever the archive changes). Members under, or matching, any of the `excludes` globs are skipped. .gitignore files
+    inside archives are not honoured.
+    """
+    _archive = os.fspath(archive)
+    _exclude = compile_globs(excludes)
+    _mtime_ns = os.stat(_archive).st_mtime_ns
+    for name, size in _reader(_archive).members():
+        if not name.endswith(extension):
+            continue
+        if _exclude is not None and _excluded(_exclude, name):
+            continue
+        yield WalkEntry(member_path(_archive, name), posixpath.basename(name), size, _mtime_ns)
+
+
+def read_member(path: str | pathlib.Path) -> bytes:
+    """
+    The bytes of the archive member at an archive!/member path
+    """
+    _split = split_member(path)
+    if _split is None:
+        raise ValueError(f"{path} is not an archive member")
+    _archive, _member = _split
+    try:
+        return _reader(_archive).read(_member)
+    except KeyError:
+        raise FileNotFoundError(f"No member {_member} in {_archive}")
+
+
+def read_source(path: str | pathlib.Path) -> bytes:
+    """
+    The bytes of a source file, which may be an archive member
+    """
+    if split_member(path) is not None:
+        return read_member(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def remove_spools() -> None:
+    """
+    Closes every archive this process has open and deletes the spools it decompressed
+    """
+    while _READERS:
+        _READERS.popitem()[1][1].close()
+    while _SPOOLS:
+        _spool = _SPOOLS.pop()
+        try:
+            os.unlink(_spool)
+        except OSError as e:
+            loguru.logger.warning(f"Could not remove {_spool}: {e}")
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import pathlib
+import random
+
+# The project roots QRParse is normally pointed at, so a synthetic tree can be scanned exactly like a real checkout
+DEFAULT_ROOTS: tuple[str, ...] = ("verifier", "e-voting", "crypto-primitives-domain", "crypto-primitives")
+
+_FIELD_TYPES: tuple[str, ...] = ("String", "GqGroup", "GroupVector<GqElement, GqGroup>", "BigInteger", "int",
+                                 "List<String>", "ElGamalMultiRecipientCiphertext", "ZqElement")
+_WORDS: tuple[str, ...] = ("election", "ballot", "box", "context", "payload", "share", "key", "proof", "vote",
+                           "group", "element", "cipher", "text", "verification", "card", "set", "tally", "mix",
+                           "shuffle", "code", "return", "choice", "primes", "table", "encryption", "parameters")
+
+
+class CorpusSpec:
+    """
+    What a synthetic Java tree should look like. The same spec and seed always produce byte-identical trees.
+    `files` source files are spread over `roots`, about `matching` of them declaring a toHashableForm(), and every file
+    carries around `filler_methods` ordinary methods to bulk it out. `large_files` of them are `large_factor` times the
+    usual size, as generated sources tend to be.
+    """
+
+    def __init__(self,
+                 files: int = 2000,
+                 seed: int = 0,
+                 roots: tuple[str, ...] = DEFAULT_ROOTS,
+                 matching: float = 0.6,
+                 filler_methods: int = 6,
+                 large_files: int = 4,
+                 large_factor: int = 60) -> None:
+        self.files = files
+        self.seed = seed
+        self.roots = tuple(roots)
+        self.matching = matching
+        self.filler_methods = filler_methods
+        self.large_files = large_files
+        self.large_factor = large_factor
+
+    def as_dict(self) -> dict:
+        return {
+            "files": self.files,
+            "seed": self.seed,
+            "roots": list(self.roots),
+            "matching": self.matching,
+            "filler_methods": self.filler_methods,
+            "large_files": self.large_files,
+            "large_factor": self.large_factor
+        }
+
+    def fingerprint(self) -> str:
+        return hashlib.sha256(json.dumps(self.as_dict(), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class _JavaWriter:
+    """
+    Produces the source of one synthetic class from a seeded random stream
+    """
+
+    def __init__(self, rng: random.Random) -> None:
+        self.rng = rng
+
+    def identifier(self, capitalise: bool = False) -> str:
+        _parts = self.rng.sample(_WORDS, self.rng.randint(1, 3))
+        _name = _parts[0] + "".join(x.capitalize() for x in _parts[1:])
+        return _name[0].upper() + _name[1:] if capitalise else _name
+
+    def fields(self) -> list[tuple[str, str]]:
+        _count = self.rng.randint(1, 7)
+        _names: list[str] = []
+        while len(_names) < _count:
+            _name = self.identifier()
+            if _name not in _names:
+                _names.append(_name)
+        return [(self.rng.choice(_FIELD_TYPES), x) for x in _names]
+
+    def filler(self, count: int) -> str:
+        _methods = []
+        for idx in range(count):
+            _name = f"{self.identifier()}{idx}"
+            _arg = self.identifier()
+            _methods.append(
+                f"\t/**\n"
+                f"\t * Computes the {_name} for the given {_arg}, see {{@link #{_name}}}.\n"
+                f"\t */\n"
+                f"\tprivate static int {_name}(final String {_arg}) {{\n"
+                f"\t\tint total = 0x{self.rng.randint(0, 0xffff):x};\n"
+                f"\t\tfor (int i = 0; i < {_arg}.length(); i++) {{\n"
+                f"\t\t\ttotal += {_arg}.charAt(i) * {self.rng.randint(2, 97)}; // mix\n"
+                f"\t\t}}\n"
+                f"\t\treturn total > {self.rng.randint(0, 1000)} ? total : \"{_name}\".hashCode();\n"
+                f"\t}}\n")
+        return "\n".join(_methods)
+
+    @staticmethod
+    def hashable_form(values: list[str], alias: str | None = None) -> str:
+        _alias = f"\t\tfinal List<HashableString> {alias}_ = {alias}.stream().map(HashableString::from).toList();\n" \
+            if alias is not None else ""
+        _values = ", ".join(values) if values else 'HashableString.from("")'
+        return (f"\t@Override\n"
+                f"\tpublic List<? extends Hashable> toHashableForm() {{\n"
+                f"{_alias}"
+                f"\t\treturn List.of({_values});\n"
+                f"\t}}\n")
+
+    def source(self, package: str, name: str, matching: bool, filler_methods: int) -> str:
+        _fields = self.fields()
+        _used = [x for _, x in _fields if self.rng.random() < 0.75]
+        _kind = self.rng.choice(("class", "record", "builder", "abstract")) if matching else "plain"
+        _header = f"package {package};\n\nimport java.util.List;\nimport java.math.BigInteger;\n\n"
+        _filler = self.filler(filler_methods)
+
+        if _kind == "record":
+            _components = ", ".join(f"{t} {x}" for t, x in _fields)
+            _alias = _fields[0][1] if self.rng.random() < 0.2 else None
+            _values = [f"{_alias}_"] if _alias is not None else []
+            _values += [f"HashableString.from({x})" for x in _used if x != _alias]
+            return (f"{_header}public record {name}({_components}) implements Hashable {{\n\n"
+                    f"\tpublic {name} {{\n"
+                    f"\t\tcheckNotNull({_fields[0][1]});\n"
+                    f"\t}}\n\n"
+                    f"{self.hashable_form(_values, _alias)}\n"
+                    f"{_filler}}}\n")
+
+        _declarations = "".join(f"\tprivate final {t} {x};\n" for t, x in _fields)
+        _assignments = "".join(f"\t\tthis.{x} = {x};\n" for _, x in _fields)
+        _arguments = ", ".join(f"final {t} {x}" for t, x in _fields)
+
+        if _kind == "builder":
+            _getters = [f"get{x[0].upper()}{x[1:]}()" for x in _used]
+            return (f"{_header}@SuppressWarnings(\"unused\")\n"
+                    f"public final class {name} extends {self.identifier(True)}Base implements Hashable {{\n\n"
+                    f"{_declarations}\n"
+                    f"\tprivate {name}({_arguments}) {{\n{_assignments}\t}}\n\n"
+                    f"{self.hashable_form(_getters)}\n"
+                    f"\tpublic static class Builder {{\n"
+                    f"\t\tpublic {name} build() {{\n"
+                    f"\t\t\treturn null;\n"
+                    f"\t\t}}\n"
+                    f"\t}}\n\n"
+                    f"{_filler}}}\n")
+
+        if _kind == "abstract":
+            return (f"{_header}public abstract class {name} implements Hashable, Comparable<{name}> {{\n\n"
+                    f"{_declarations}\n"
+                    f"\tpublic abstract int {self.identifier()}();\n\n"
+                    f"{self.hashable_form(_used)}\n"
+                    f"{_filler}}}\n")
+
+        _body = self.hashable_form([f"HashableString.from({x})" for x in _used]) if _kind == "class" else ""
+        return (f"{_header}public class {name} {'implements Hashable ' if _kind == 'class' else ''}{{\n\n"
+                f"{_declarations}\n"
+                f"\tpublic {name}({_arguments}) {{\n{_assignments}\t}}\n\n"
+                f"{_body}\n"
+                f"{_filler}}}\n")
+
+
+def generate_corpus(root: str | pathlib.Path, spec: CorpusSpec) -> tuple[int, int]:
+    """
+    Writes the synthetic tree described by `spec` under `root`, one directory per spec root laid out like a Maven
+    project, and returns (files, bytes) written
+    """
+    _root = pathlib.Path(root)
+    _rng = random.Random(spec.seed)
+    _writer = _JavaWriter(_rng)
+    _large = set(_rng.sample(range(spec.files), min(spec.large_files, spec.files)))
+    _bytes = 0
+    _names: set[str] = set()
+
+    for idx in range(spec.files):
+        _project = spec.roots[idx % len(spec.roots)]
+        _package = f"ch.post.it.evoting.{_project.replace('-', '')}.{_rng.choice(_WORDS)}"
+        _name = _writer.identifier(True)
+        while _name in _names:
+            _name = f"{_writer.identifier(True)}{idx}"
+        _names.add(_name)
+
+        _dir = _root / _project / "src" / "main" / "java" / pathlib.Path(*_package.split("."))
+        os.makedirs(_dir, exist_ok=True)
+        _filler = spec.filler_methods * (spec.large_factor if idx in _large else 1)
+        _source = _writer.source(_package, _name, _rng.random() < spec.matching, _filler)
+        _encoded = _source.encode("utf-8")
+        with open(_dir / f"{_name}.java", "wb") as h:
+            h.write(_encoded)
+        _bytes += len(_encoded)
+
+    return spec.files, _bytes
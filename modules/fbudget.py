@@ -0,0 +1,111 @@
+import faulthandler
+import signal
+import threading
+
+import loguru
+
+# How long a single pattern may run against a single file before it is abandoned
+DEFAULT_REGEX_BUDGET: float = 10.0
+# Slack on top of the summed regex budgets before a worker is considered wedged and killed outright
+HARD_LIMIT_GRACE: float = 30.0
+
+
+class RegexBudgetExceeded(Exception):
+    """
+    Raised out of a regex that ran past its budget, carrying the label of the pattern it was running
+    """
+
+    def __init__(self, label: str, seconds: float) -> None:
+        super().__init__(f"{label} ran for longer than its {seconds}s budget")
+        self.label = label
+        self.seconds = seconds
+
+
+class _NullGuard:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullGuard":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_GUARD = _NullGuard()
+
+
+class _Guard:
+    __slots__ = ("budget", "label")
+
+    def __init__(self, budget: "RegexBudget", label: str) -> None:
+        self.budget = budget
+        self.label = label
+
+    def __enter__(self) -> "_Guard":
+        self.budget.current = self.label
+        signal.setitimer(signal.ITIMER_REAL, self.budget.seconds)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        self.budget.current = None
+
+
+class RegexBudget:
+    """
+    Bounds how long any one regex may run. Python's regex engine checks for signals as it goes, so a SIGALRM timer armed
+    around a search interrupts even a catastrophically backtracking one, and the handler turns it into
+    RegexBudgetExceeded. Each process has its own (BUDGET), which does nothing until enabled, and can only be enabled on
+    the main thread of a platform with SIGALRM.
+    For the rare case a signal never gets through, `watchdog` arms faulthandler to dump the stack and kill the process
+    outright, which is only ever worth doing in a pool worker that the pool will replace.
+    """
+
+    def __init__(self) -> None:
+        self.seconds: float | None = None
+        self.current: str | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.seconds is not None
+
+    def enable(self, seconds: float | None) -> bool:
+        """
+        Starts enforcing a budget of `seconds` per guarded regex (None or 0 to stop), returns whether it is enforced
+        """
+        if not seconds:
+            self.seconds = None
+            return False
+        if not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+            loguru.logger.warning("Regex budgets need SIGALRM on the main thread, running without them")
+            self.seconds = None
+            return False
+        signal.signal(signal.SIGALRM, self._expired)
+        self.seconds = seconds
+        return True
+
+    def _expired(self, signum, frame) -> None:
+        # A timer that went off just as its guard was being left is ignored rather than raised into unrelated code
+        if self.current is not None:
+            raise RegexBudgetExceeded(self.current, self.seconds)
+
+    def guard(self, label: str) -> _Guard | _NullGuard:
+        """
+        Runs the body of a with block under the budget, as the pattern `label`. Guards don't nest.
+        """
+        if self.seconds is None:
+            return _NULL_GUARD
+        return _Guard(self, label)
+
+    @staticmethod
+    def watchdog(seconds: float | None) -> None:
+        """
+        Kills this process, after dumping every thread's stack to stderr, unless disarmed within `seconds`. None disarms.
+        """
+        if seconds is None:
+            faulthandler.cancel_dump_traceback_later()
+        else:
+            faulthandler.dump_traceback_later(seconds, exit=True)
+
+
+BUDGET: RegexBudget = RegexBudget()
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from typing import Any
+
+import loguru
+
+DEFAULT_CACHE_DIR: pathlib.Path = pathlib.Path(os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache")) \
+    / "qrparse"
+DEFAULT_MAX_ENTRIES: int = 250_000
+CACHE_FILE_NAME: str = "scan-cache.sqlite3"
+
+# Uncommitted writes are flushed every so often so an interrupted run still keeps most of its work
+_COMMIT_EVERY: int = 1000
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    A stable hash of anything json serialisable, used to tell apart results computed with different pattern sets
+    """
+    _blob = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(_blob).hexdigest()
+
+
+class ScanCache:
+    """
+    A persistent cache of per-file scan results, stored in a SQLite database under `cache_dir`.
+    Entries are keyed by path and are only handed back while the file's size and mtime, and the fingerprint of the
+    patterns the result was computed with, are unchanged. Once the cache holds more than `max_entries` files, the least
+    recently used ones are evicted when the cache is closed.
+    """
+
+    def __init__(self,
+                 cache_dir: str | pathlib.Path,
+                 pattern_fingerprint: str,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 rebuild: bool = False) -> None:
+        self.path = pathlib.Path(cache_dir) / CACHE_FILE_NAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fingerprint = pattern_fingerprint
+        self.max_entries = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        self._stamp: int = time.time_ns()
+        self._touched: list[tuple[int, str]] = []
+        self._pending: int = 0
+
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS files ("
+                         "path TEXT PRIMARY KEY, "
+                         "size INTEGER NOT NULL, "
+                         "mtime_ns INTEGER NOT NULL, "
+                         "fingerprint TEXT NOT NULL, "
+                         "payload TEXT NOT NULL, "
+                         "last_used INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)")
+        if rebuild:
+            loguru.logger.info(f"Rebuilding scan cache at {self.path}")
+            self._db.execute("DELETE FROM files")
+        self._db.commit()
+
+    def get(self, path: str, size: int, mtime_ns: int) -> dict | None:
+        """
+        The cached payload for `path`, or None if there isn't one or it is stale
+        """
+        _row = self._db.execute("SELECT size, mtime_ns, fingerprint, payload FROM files WHERE path = ?",
+                                (path,)).fetchone()
+        if _row is None or _row[0] != size or _row[1] != mtime_ns or _row[2] != self.fingerprint:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touched.append((self._stamp, path))
+        return json.loads(_row[3])
+
+    def put(self, path: str, size: int, mtime_ns: int, payload: dict) -> None:
+        self._db.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, fingerprint, payload, last_used) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (path, size, mtime_ns, self.fingerprint, json.dumps(payload), self._stamp))
+        self._pending += 1
+        if self._pending >= _COMMIT_EVERY:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        """
+        Records which entries were used this run, evicts the least recently used entries over `max_entries` and
+        closes the database
+        """
+        self._db.executemany("UPDATE files SET last_used = ? WHERE path = ?", self._touched)
+        self._touched = []
+        _evicted = self._db.execute("DELETE FROM files WHERE path IN ("
+                                    "SELECT path FROM files ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                                    (self.max_entries,)).rowcount
+        self._db.commit()
+        self._db.close()
+        loguru.logger.info(f"Scan cache: {self.hits} hits, {self.misses} misses, {_evicted} evicted.")
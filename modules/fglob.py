@@ -1,38 +1,85 @@
+import mmap
 import pathlib
-from typing import Generator
+from typing import Generator, Iterable
 from modules.meta import McSingleton
+from modules.farchive import is_archive, walk_archive, read_source
+from modules.fwalk import walk, WalkEntry, DEFAULT_EXCLUDES, DEFAULT_BUILD_OUTPUTS
 import loguru
 
 
 class SourceLoadConfig(metaclass=McSingleton):
     SourceFileExtension: str = None
+    Excludes: tuple[str, ...] = None
+    HonourGitignore: bool = None
+    BuildOutputs: tuple[str, ...] = None
 
     def __init__(self):
         if self.SourceFileExtension is None:
             self.SourceFileExtension = ""
+        if self.Excludes is None:
+            self.Excludes = DEFAULT_EXCLUDES
+        if self.HonourGitignore is None:
+            self.HonourGitignore = False
+        if self.BuildOutputs is None:
+            self.BuildOutputs = DEFAULT_BUILD_OUTPUTS
 
     def set_source_file_extension(self, source_file_extension: str) -> None:
         loguru.logger.debug(f"Updated source load config to search for source "
                             f"files with extension: {source_file_extension}")
         self.SourceFileExtension = source_file_extension
 
+    def set_excludes(self,
+                     excludes: Iterable[str],
+                     honour_gitignore: bool = False,
+                     build_outputs: Iterable[str] = DEFAULT_BUILD_OUTPUTS) -> None:
+        self.Excludes = tuple(excludes)
+        self.HonourGitignore = honour_gitignore
+        self.BuildOutputs = tuple(build_outputs)
+        loguru.logger.debug(f"Updated source load config to skip {self.Excludes} and build outputs {self.BuildOutputs} "
+                            f"({'honouring' if honour_gitignore else 'ignoring'} .gitignore files)")
+
+
+def decode_source(raw: bytes | mmap.mmap) -> str:
+    """
+    Decodes the raw bytes of a source file (or any buffer holding them, such as an mmap) exactly as reading it in text
+    mode would, UTF-8 with universal newlines
+    """
+    _text = str(raw, 'utf-8')
+    if "\r" in _text:
+        _text = _text.replace("\r\n", "\n").replace("\r", "\n")
+    return _text
+
 
 class SourceFile:
     """
-    An object representing a SourceFile, containing the file path, name and contents
+    An object representing a SourceFile, containing the file path, name and raw bytes. The bytes are only read, and
+    the contents only decoded, on first access, so a SourceFile can stand in for a file that is read somewhere else.
     """
-    def __init__(self, path: pathlib.Path):
+    def __init__(self, path: pathlib.Path, size: int | None = None):
         self.path = path
         self.name = path.name
-        with open(self.path, 'r', encoding='utf-8') as f:
-            self.contents = f.read()
+        self.size = size
+        self._raw: bytes | None = None
+        self._contents: str | None = None
+
+    @property
+    def raw(self) -> bytes:
+        if self._raw is None:
+            self._raw = read_source(self.path)
+        return self._raw
+
+    @property
+    def contents(self) -> str:
+        if self._contents is None:
+            self._contents = decode_source(self.raw)
+        return self._contents
 
 
 class SourceFileLoader:
     """
-    An iterable object of SourceFiles globbed from the given directory and all subdirectories based on file extension.
+    An iterable object of SourceFiles walked from the given directory and all subdirectories based on file extension.
     By default, we look for '.java' file extensions, but this can be overriden with the `--type` command-line argument,
-    or with the TARGET_SOURCE_EXTENSION environment variable (use a .env file)
+    or with the TARGET_SOURCE_EXTENSION environment variable (use a .env file). A source archive is read in place.
     """
 
     def __init__(self, project_path: str) -> None:
@@ -40,14 +87,22 @@ class SourceFileLoader:
         assert _config.SourceFileExtension is not None and _config.SourceFileExtension != ""
         self.path = pathlib.Path(project_path)
         self.depleted: bool = False
-        self.files: Generator = self.path.glob(f"**/*{_config.SourceFileExtension}")
+        if is_archive(self.path):
+            self.files: Generator[WalkEntry, None, None] = walk_archive(self.path, _config.SourceFileExtension,
+                                                                        excludes=_config.Excludes)
+        else:
+            self.files = walk(self.path, _config.SourceFileExtension,
+                              excludes=_config.Excludes,
+                              gitignore=_config.HonourGitignore,
+                              build_outputs=_config.BuildOutputs)
         self.current_idx: int = 0
 
     def __iter__(self):
         return self
 
     def __next__(self) -> SourceFile:
-        return SourceFile(self.files.__next__())
+        _entry = self.files.__next__()
+        return SourceFile(pathlib.Path(_entry.path), size=_entry.size)
 
 
 def create_file_loader(project_path: str) -> SourceFileLoader:
@@ -1,33 +1,264 @@
 from modules.fglob import create_file_loader, SourceLoadConfig, SourceFileLoader, SourceFile
+from modules.farchive import remove_spools
+from modules.fpipe import BoundedPipeline, ReorderBuffer, INFLIGHT_PER_WORKER
+from modules.fsched import available_cpus, WorkerUtilisation, DEFAULT_CHUNK_BYTES
+from modules.lexpatterns import TokenTable
+import fnmatch
+import multiprocessing
+import os
+import pathlib
+import re
+import time
 import loguru
 import pygments
 from pygments import lexers
-from typing import Iterable
+from pygments.lexer import Lexer
+from pygments.util import ClassNotFound
+from typing import Generator, Iterable, Self
+
+
+class LexerCache:
+    """
+    Resolves lexers by file extension rather than file by file. Every lexer's filename patterns are read once, those of
+    the form *.ext are indexed by their extension and the rest (Makefile, CMakeLists.txt, Makefile.*, *.[ch]) are
+    folded into a single regex, so a file only has the rest matched against it one by one when that regex hits. Each
+    lexer is only ever instantiated once. Where just one lexer claims a file it is used without looking at its contents,
+    only when several do are its contents analysed to pick between them, as pygments.lexers.guess_lexer_for_filename
+    would.
+    An override, set by name or alias, is used for every file regardless of its name.
+    Each process has its own (LEXERS).
+    """
+
+    # A pattern matching every file with one extension and nothing else
+    EXTENSION_PATTERN: re.Pattern = re.compile(r"\*\.[^*?\[\]./]+")
+
+    def __init__(self) -> None:
+        self.override: Lexer | None = None
+        # extension -> [(lexer class, matched a primary filename pattern)]
+        self.candidates: dict[str, list[tuple[type[Lexer], bool]]] | None = None
+        # (pattern, lexer class, is a primary filename pattern) for every pattern that isn't *.ext
+        self.patterns: list[tuple[str, type[Lexer], bool]] = []
+        self.any_pattern: re.Pattern | None = None
+        self.instances: dict[type[Lexer], Lexer] = {}
+
+    def set_override(self, name: str | None) -> None:
+        """
+        Lexes every file with the lexer called `name` (any of its aliases), None to go back to resolving by file name.
+        Raises ClassNotFound for an unknown name.
+        """
+        self.override = lexers.get_lexer_by_name(name) if name else None
+        if self.override is not None:
+            loguru.logger.debug(f"Lexing every file with {self.override.name}")
+
+    def _instance(self, lexer_class: type[Lexer]) -> Lexer:
+        _lexer = self.instances.get(lexer_class)
+        if _lexer is None:
+            _lexer = self.instances[lexer_class] = lexer_class()
+        return _lexer
+
+    def _load(self) -> dict[str, list[tuple[type[Lexer], bool]]]:
+        _by_extension: dict[str, dict[type[Lexer], bool]] = {}
+        for name, _, _, _ in lexers.get_all_lexers():
+            _class = lexers.find_lexer_class(name)
+            if _class is None:
+                continue
+            # A lexer matched by any of its alias patterns isn't a primary match, whichever others match too
+            for primary, patterns in ((True, _class.filenames), (False, _class.alias_filenames)):
+                for pattern in patterns:
+                    if self.EXTENSION_PATTERN.fullmatch(pattern):
+                        _matching = _by_extension.setdefault(pattern[1:], {})
+                        _matching[_class] = _matching.get(_class, True) and primary
+                    else:
+                        self.patterns.append((pattern, _class, primary))
+        self.any_pattern = re.compile("|".join(fnmatch.translate(x) for x, _, _ in self.patterns))
+        self.candidates = {k: list(v.items()) for k, v in _by_extension.items()}
+        loguru.logger.debug(f"Indexed lexers by {len(self.candidates)} extensions and {len(self.patterns)} other "
+                            f"filename patterns")
+        return self.candidates
+
+    def _resolve(self, name: str) -> list[tuple[type[Lexer], bool]]:
+        _candidates = self.candidates if self.candidates is not None else self._load()
+        _, _dot, _extension = name.rpartition(".")
+        _by_extension = _candidates.get("." + _extension, []) if _dot else []
+        if self.any_pattern.match(name) is None:
+            return _by_extension
+        _matching = dict(_by_extension)
+        for pattern, lexer_class, primary in self.patterns:
+            if fnmatch.fnmatchcase(name, pattern):
+                _matching[lexer_class] = _matching.get(lexer_class, True) and primary
+        return list(_matching.items())
+
+    def lexer_for(self, filename: str, contents: str) -> Lexer:
+        """
+        The lexer for the file `filename`, `contents` only being analysed if several lexers claim it. Raises
+        ClassNotFound when none does.
+        """
+        if self.override is not None:
+            return self.override
+        _name = os.path.basename(filename)
+        _candidates = self._resolve(_name)
+        if not _candidates:
+            raise ClassNotFound(f"no lexer for filename {_name!r} found")
+        if len(_candidates) == 1:
+            return self._instance(_candidates[0][0])
+
+        _rated = []
+        for lexer_class, primary in _candidates:
+            _rating = lexer_class.analyse_text(contents)
+            if _rating == 1.0:
+                return self._instance(lexer_class)
+            _rated.append((_rating, primary, lexer_class.priority, lexer_class.__name__, lexer_class))
+        return self._instance(max(_rated, key=lambda x: x[:4])[4])
+
+
+LEXERS: LexerCache = LexerCache()
 
 
 class LexFile:
     source: SourceFile = None
     tokens: Iterable = None
+    # Only set when the file was lexed by a worker process
+    table: TokenTable | None = None
 
     def __init__(self, source: SourceFile) -> None:
         # print(source)
         self.sn: str = source.name
         self.source: SourceFile = source
-        _lexer = lexers.guess_lexer_for_filename(self.sn, source.contents)
+        _lexer = LEXERS.lexer_for(self.sn, source.contents)
         self.tokens = pygments.lex(source.contents, _lexer)
         loguru.logger.debug(f"Lexed file {self.sn}")
 
+    @classmethod
+    def from_table(cls, source: SourceFile, table: TokenTable) -> Self:
+        """
+        A LexFile for a source that has already been lexed into `table`, its tokens streamed back out of the table
+        """
+        _inst = cls.__new__(cls)
+        _inst.sn = source.name
+        _inst.source = source
+        _inst.table = table
+        _inst.tokens = table.stream()
+        return _inst
+
+
+def mp_init_lexer(lexer: str | None = None) -> None:
+    """
+    Pool initializer, sets the lexer override in the worker process
+    """
+    LEXERS.set_override(lexer)
+
+
+def mp_lex_chunk(chunk: list[tuple[int, str, int]]) -> tuple[int, float, list[tuple[int, TokenTable]]]:
+    """
+    Reads and lexes a batch of (index, path, size) files into TokenTables, which pickle as a handful of flat arrays
+    rather than one object per token. Returns the worker's pid and how long it spent on the chunk alongside them.
+    """
+    _started = time.perf_counter()
+    _results = []
+    for idx, path, size in chunk:
+        _source = SourceFile(pathlib.Path(path), size=size)
+        _lexer = LEXERS.lexer_for(_source.name, _source.contents)
+        _results.append((idx, TokenTable.from_stream(pygments.lex(_source.contents, _lexer))))
+    return os.getpid(), time.perf_counter() - _started, _results
+
 
 class LexFileGenerator:
+    """
+    Lexes every source file under `path` with the extension `source_file_ext`, using the lexer called `lexer` if given,
+    or the one LEXERS resolves for the extension.
+    With a single process (the default) files are read and lexed one at a time as they are asked for. With more,
+    `processes` workers (None for as many as there are CPUs available) lex them into TokenTables, which come back as
+    LexFiles with their `table` set, in walk order or, unless `ordered`, in whatever order they finish. Only paths are
+    handed to the pool, in chunks of at most `chunk_size` files or about `chunk_bytes` of source, and the walk only runs
+    INFLIGHT_PER_WORKER chunks per worker ahead of the results, so memory stays flat on any size of tree.
+    """
     loader: SourceFileLoader = None
 
-    def __init__(self, *, path: str, source_file_ext: str):
+    def __init__(self,
+                 *,
+                 path: str,
+                 source_file_ext: str,
+                 lexer: str | None = None,
+                 processes: int | None = 1,
+                 chunk_size: int = 16,
+                 chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                 ordered: bool = True):
         SourceLoadConfig().set_source_file_extension(source_file_ext)
+        LEXERS.set_override(lexer)
         self.loader = create_file_loader(path)
-        loguru.logger.debug(f"Connected lex generator to source loader stream")
+        self.processes = available_cpus() if processes is None else max(processes, 1)
+        self.chunk_size = max(chunk_size, 1)
+        self.chunk_bytes = max(chunk_bytes, 1)
+        self.ordered = ordered
+        self.pool = None
+        self._lexed: Generator[LexFile, None, None] | None = None
+        if self.processes > 1:
+            self.pool = multiprocessing.Pool(processes=self.processes, initializer=mp_init_lexer, initargs=(lexer,))
+            self._lexed = self._lex_parallel()
+            loguru.logger.debug(f"Connected lex generator to source loader stream over {self.processes} processes")
+        else:
+            loguru.logger.debug(f"Connected lex generator to source loader stream")
 
     def __iter__(self):
         return self
 
     def __next__(self) -> LexFile:
+        if self._lexed is not None:
+            return self._lexed.__next__()
         return LexFile(self.loader.__next__())
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._lexed is not None:
+            self._lexed.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        remove_spools()
+
+    def _lex_parallel(self) -> Generator[LexFile, None, None]:
+        _order: ReorderBuffer[LexFile] = ReorderBuffer()
+        _sources: dict[int, SourceFile] = {}
+        _utilisation = WorkerUtilisation()
+        _chunk: list[tuple[int, str, int]] = []
+        _chunk_bytes = 0
+
+        def _collect(result: tuple[int, float, list[tuple[int, TokenTable]]]) -> Generator[LexFile, None, None]:
+            _pid, _busy, _chunk_result = result
+            _utilisation.record(_pid, _busy, len(_chunk_result), sum(len(x.source) for _, x in _chunk_result))
+            for idx, table in _chunk_result:
+                _lf = LexFile.from_table(_sources.pop(idx), table)
+                if self.ordered:
+                    yield from _order.push(idx, _lf)
+                else:
+                    yield _lf
+
+        _pipeline: BoundedPipeline[LexFile] = BoundedPipeline(self.pool, mp_lex_chunk,
+                                                              self.processes * INFLIGHT_PER_WORKER, _collect)
+        try:
+            for idx, source in enumerate(self.loader):
+                _sources[idx] = source
+                _chunk.append((idx, str(source.path), source.size or 0))
+                _chunk_bytes += source.size or 0
+                if len(_chunk) >= self.chunk_size or _chunk_bytes >= self.chunk_bytes:
+                    yield from _pipeline.submit(_chunk)
+                    _chunk = []
+                    _chunk_bytes = 0
+                yield from _pipeline.poll()
+            if _chunk:
+                yield from _pipeline.submit(_chunk)
+            yield from _pipeline.drain()
+            _utilisation.log(self.processes)
+        finally:
+            self._lexed = None
+            if self.pool is not None:
+                # Either every result is in or the caller stopped early, so nothing the workers are still on is needed
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
@@ -0,0 +1,442 @@
+import mmap
+import re
+import time
+from typing import Generator, Iterable
+
+import loguru
+
+from modules.fbudget import BUDGET, RegexBudgetExceeded
+from modules.fglob import decode_source
+from modules.fprof import PROFILER
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # python < 3.11
+    import sre_parse
+    import sre_constants
+
+# Literal runs shorter than this reject too few files to be worth a prefilter pass
+MIN_LITERAL_LENGTH: int = 3
+# Files at least this large are memory mapped rather than read, and decoded a window of this many bytes at a time
+DEFAULT_MMAP_THRESHOLD: int = 8 * 2 ** 20
+MMAP_WINDOW: int = 2 ** 20
+
+# Bytes that can make a bytes pattern disagree with its str form: anything outside ASCII, the separators \x1c-\x1f that
+# str patterns count as whitespace and bytes patterns don't, and carriage returns, which text mode turns into newlines
+_NOT_BYTES_SAFE: re.Pattern = re.compile(rb"[\r\x1c-\x1f\x80-\xff]")
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, "POSSESSIVE_REPEAT"):
+    _REPEATS.add(sre_constants.POSSESSIVE_REPEAT)
+
+# Character sets are compared over ASCII only, which is where every pattern we ship (and most we're given) lives
+_ASCII: frozenset[int] = frozenset(range(128))
+_CATEGORIES: dict = {
+    sre_constants.CATEGORY_DIGIT: frozenset(x for x in _ASCII if chr(x).isdigit()),
+    sre_constants.CATEGORY_SPACE: frozenset(x for x in _ASCII if chr(x).isspace()),
+    sre_constants.CATEGORY_WORD: frozenset(x for x in _ASCII if chr(x).isalnum() or chr(x) == "_"),
+    sre_constants.CATEGORY_LINEBREAK: frozenset((10,)),
+}
+for _category, _negated in ((sre_constants.CATEGORY_DIGIT, sre_constants.CATEGORY_NOT_DIGIT),
+                            (sre_constants.CATEGORY_SPACE, sre_constants.CATEGORY_NOT_SPACE),
+                            (sre_constants.CATEGORY_WORD, sre_constants.CATEGORY_NOT_WORD),
+                            (sre_constants.CATEGORY_LINEBREAK, sre_constants.CATEGORY_NOT_LINEBREAK)):
+    _CATEGORIES[_negated] = _ASCII - _CATEGORIES[_category]
+
+
+def required_literals(pattern: str) -> list[str]:
+    """
+    Walks the parsed form of a regex and pulls out every run of literal characters that any match of the pattern is
+    guaranteed to contain. Anything that can vary (classes, wildcards, alternations, optional repeats) ends the current
+    run, case-insensitive sections contribute nothing.
+    """
+    _parsed = sre_parse.parse(pattern)
+    if _parsed.state.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return []
+
+    runs: list[str] = []
+    current: list[str] = []
+
+    def _flush() -> None:
+        if current:
+            runs.append("".join(current))
+            current.clear()
+
+    def _walk(sub_pattern) -> None:
+        for op, av in sub_pattern:
+            if op is sre_constants.LITERAL:
+                current.append(chr(av))
+            elif op is sre_constants.AT:
+                # anchors are zero width, the literal run carries on either side of them
+                continue
+            elif op is sre_constants.SUBPATTERN:
+                _group, _add_flags, _del_flags, _inner = av
+                if _add_flags & sre_constants.SRE_FLAG_IGNORECASE:
+                    _flush()
+                    continue
+                _walk(_inner)
+            elif op in _REPEATS:
+                _min, _max, _inner = av
+                _flush()
+                if _min >= 1:
+                    _walk(_inner)
+                    _flush()
+            else:
+                _flush()
+
+    _walk(_parsed)
+    _flush()
+    return runs
+
+
+def _single_char_set(op, av) -> frozenset[int] | None:
+    """
+    The (ASCII) characters a single character item can match, None if the item isn't a single character
+    """
+    if op is sre_constants.LITERAL:
+        return frozenset((av,))
+    if op is sre_constants.NOT_LITERAL:
+        return _ASCII - {av}
+    if op is sre_constants.ANY:
+        return _ASCII
+    if op is not sre_constants.IN:
+        return None
+
+    _chars: set[int] = set()
+    _negate = False
+    for _op, _av in av:
+        if _op is sre_constants.NEGATE:
+            _negate = True
+        elif _op is sre_constants.LITERAL:
+            _chars.add(_av)
+        elif _op is sre_constants.RANGE:
+            _chars.update(range(_av[0], min(_av[1], 127) + 1))
+        elif _op is sre_constants.CATEGORY:
+            _chars.update(_CATEGORIES.get(_av, _ASCII))
+        else:
+            return None
+    return _ASCII - _chars if _negate else frozenset(_chars)
+
+
+def _repeated_char_set(op, av) -> frozenset[int] | None:
+    """
+    For an unbounded repeat of a single character item, the characters it repeats over, None for anything else
+    """
+    if op not in _REPEATS or av[1] != sre_constants.MAXREPEAT or len(av[2]) != 1:
+        return None
+    return _single_char_set(*av[2][0])
+
+
+def _contains_unbounded_repeat(sub_pattern) -> bool:
+    for op, av in sub_pattern:
+        if op in _REPEATS and (av[1] == sre_constants.MAXREPEAT or _contains_unbounded_repeat(av[2])):
+            return True
+        if op is sre_constants.SUBPATTERN and _contains_unbounded_repeat(av[3]):
+            return True
+        if op is sre_constants.BRANCH and any(_contains_unbounded_repeat(x) for x in av[1]):
+            return True
+    return False
+
+
+def backtracking_risks(pattern: str) -> list[str]:
+    """
+    Looks for the constructs that make a backtracking regex engine go exponential or polynomial on input that almost
+    matches: unbounded repeats nested inside unbounded repeats, unbounded repeats of overlapping character sets next to
+    each other, and alternations under an unbounded repeat whose branches can start with the same character.
+    This is a heuristic, a clean bill of health is no guarantee.
+    """
+    _risks: list[str] = []
+
+    def _walk(sub_pattern, in_unbounded: bool) -> None:
+        _items = list(sub_pattern)
+        for idx, (op, av) in enumerate(_items):
+            if op in _REPEATS:
+                _min, _max, _inner = av
+                _unbounded = _max == sre_constants.MAXREPEAT
+                if _unbounded and _contains_unbounded_repeat(_inner):
+                    _risks.append("an unbounded repeat nested inside another unbounded repeat")
+                    continue
+
+                _chars = _repeated_char_set(op, av)
+                if _chars is not None:
+                    # the next item, looking through the start of a group, is another repeat over some of the same chars
+                    _next = _items[idx + 1] if idx + 1 < len(_items) else None
+                    while _next is not None and _next[0] is sre_constants.SUBPATTERN and _next[1][3]:
+                        _next = _next[1][3][0]
+                    _next_chars = None if _next is None else _repeated_char_set(*_next)
+                    if _next_chars is not None and _chars & _next_chars:
+                        _risks.append("adjacent unbounded repeats over overlapping character sets")
+                _walk(_inner, in_unbounded or _unbounded)
+
+            elif op is sre_constants.SUBPATTERN:
+                _walk(av[3], in_unbounded)
+
+            elif op is sre_constants.BRANCH:
+                if in_unbounded:
+                    _firsts = [_single_char_set(*x[0]) if x else None for x in av[1]]
+                    _known = [x for x in _firsts if x is not None]
+                    if any(a & b for i, a in enumerate(_known) for b in _known[i + 1:]):
+                        _risks.append("an alternation of overlapping branches under an unbounded repeat")
+                for _branch in av[1]:
+                    _walk(_branch, in_unbounded)
+
+    _walk(sre_parse.parse(pattern), False)
+    return list(dict.fromkeys(_risks))
+
+
+def warn_backtracking(patterns: dict[str, str | Iterable[str]]) -> dict[str, list[str]]:
+    """
+    Runs backtracking_risks over a pattern dict (values may be a pattern or a list of them, as in SUB_PATTERNS), logs a
+    warning for every risky pattern and returns pattern -> risks for those
+    """
+    _risky: dict[str, list[str]] = {}
+    for p_key, value in patterns.items():
+        for pattern in ([value] if isinstance(value, str) else value):
+            _risks = backtracking_risks(pattern)
+            if not _risks:
+                continue
+            _risky[pattern] = _risks
+            loguru.logger.warning(f"Pattern {p_key!r} ({pattern}) is prone to catastrophic backtracking: "
+                                  f"{'; '.join(_risks)}")
+    return _risky
+
+
+_CONTEXTUAL = {sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT, sre_constants.GROUPREF,
+               sre_constants.GROUPREF_EXISTS}
+
+
+def _is_contextual(sub_pattern) -> bool:
+    for op, av in sub_pattern:
+        if op in _CONTEXTUAL:
+            return True
+        if op in _REPEATS and _is_contextual(av[2]):
+            return True
+        if op is sre_constants.SUBPATTERN and _is_contextual(av[3]):
+            return True
+        if op is sre_constants.BRANCH and any(_is_contextual(x) for x in av[1]):
+            return True
+    return False
+
+
+def window_margin(pattern: str) -> int | None:
+    """
+    The most characters any match of `pattern` can span, if whether it matches at a position depends on nothing but
+    that many characters from there on (no anchors, lookarounds or backreferences), otherwise None.
+    Such a pattern finds the same first match scanning a text window by window as it does over the whole text, as long
+    as each window runs on by this margin past the positions it is responsible for.
+    """
+    _parsed = sre_parse.parse(pattern)
+    _width = _parsed.getwidth()[1]
+    if _width >= sre_constants.MAXREPEAT or _is_contextual(_parsed):
+        return None
+    return _width
+
+
+def _boundary(buffer, at: int, forward: bool = False) -> int:
+    """
+    The nearest offset at or before (or after) `at` that a UTF-8 text can be split at without splitting a character or
+    a \r\n
+    """
+    _size = len(buffer)
+    while 0 < at < _size and (0x80 <= buffer[at] < 0xc0 or (buffer[at - 1] == 0x0d and buffer[at] == 0x0a)):
+        at += 1 if forward else -1
+    return at
+
+
+def decoded_windows(buffer, window: int, margin: int) -> Generator[tuple[int, int, str], None, None]:
+    """
+    Decodes raw UTF-8 (anything sliceable to bytes, such as an mmap) a window at a time, as decode_source would decode
+    the whole of it, yielding (character offset of the window, characters it is responsible for, text).
+    Each text runs on past the characters the window is responsible for by at least `margin` characters (or to the
+    end), so only about `window` bytes are ever decoded at once.
+    """
+    _size = len(buffer)
+    _chars = 0
+    _start = 0
+    # A character is at most 4 bytes, a decoded \n at most 2
+    _margin_bytes = 4 * (margin + 1)
+    while _start < _size:
+        _end = _boundary(buffer, min(_start + window, _size))
+        if _end <= _start:
+            _end = _boundary(buffer, min(_start + window, _size), forward=True)
+        _owned = decode_source(buffer[_start:_end])
+        _tail = decode_source(buffer[_end:_boundary(buffer, min(_end + _margin_bytes, _size))])
+        yield _chars, len(_owned), _owned + _tail
+        _chars += len(_owned)
+        _start = _end
+
+
+def prefilter_literal(pattern: str) -> str | None:
+    """
+    The longest literal that every match of `pattern` must contain, or None if there isn't one worth filtering on
+    """
+    _runs = [x for x in required_literals(pattern) if len(x) >= MIN_LITERAL_LENGTH]
+    if not _runs:
+        return None
+    return max(_runs, key=len)
+
+
+def _compile_bytes(pattern: str) -> re.Pattern | None:
+    """
+    The bytes form of an ASCII pattern, None if the pattern isn't ASCII or only makes sense over str
+    """
+    if not pattern.isascii():
+        return None
+    try:
+        return re.compile(pattern.encode("ascii"))
+    except re.error:
+        return None
+
+
+class PatternSet:
+    """
+    A set of named regex patterns compiled once and matched together.
+    A scan for the required literal of every pattern rejects most files outright, the full regexes are then only run for
+    the patterns whose literal actually shows up in the text. Patterns without a usable literal are always run in full.
+    Raw file bytes can be matched without decoding them: the literal scan runs over the bytes, and only a file that gets
+    past it is decoded. A memory mapped file is never read into memory whole to be matched: the bytes form of each
+    pattern runs straight over the mapping if it is plain ASCII (so byte offsets are character offsets), and if it has
+    to be decoded after all, it is decoded and matched window by window for every pattern that allows it (see
+    window_margin).
+    """
+
+    def __init__(self, patterns: dict[str, str]) -> None:
+        self.patterns: dict[str, str] = dict(patterns)
+        self.compiled: dict[str, re.Pattern] = {}
+        self.compiled_bytes: dict[str, re.Pattern | None] = {}
+        self.margins: dict[str, int | None] = {}
+        self.literals: dict[str, str | None] = {}
+        self._unfiltered: set[str] = set()
+        self._by_literal: dict[str, list[str]] = {}
+        self._unfiltered_bytes: set[str] = set()
+        self._by_literal_bytes: dict[bytes, list[str]] = {}
+
+        for p_key, pattern in self.patterns.items():
+            self.compiled[p_key] = re.compile(pattern)
+            self.compiled_bytes[p_key] = _compile_bytes(pattern)
+            self.margins[p_key] = window_margin(pattern)
+            _literal = prefilter_literal(pattern)
+            self.literals[p_key] = _literal
+            if _literal is None:
+                self._unfiltered.add(p_key)
+                self._unfiltered_bytes.add(p_key)
+                continue
+            self._by_literal.setdefault(_literal, []).append(p_key)
+            # Raw bytes are filtered on the literal as UTF-8, which turns up in the encoded text wherever it does in the
+            # decoded text, except across a line break that is still \r\n or \r, so only its longest line counts
+            _line = max(re.split(r"[\r\n]", _literal), key=len)
+            if len(_line) < MIN_LITERAL_LENGTH:
+                self._unfiltered_bytes.add(p_key)
+            else:
+                self._by_literal_bytes.setdefault(_line.encode("utf-8"), []).append(p_key)
+
+    def candidates(self, text: str | bytes | mmap.mmap) -> set[str]:
+        """
+        The keys of the patterns that could possibly match `text`, which may be decoded text or raw UTF-8
+        """
+        if isinstance(text, str):
+            _candidates = set(self._unfiltered)
+            _by_literal = self._by_literal
+        else:
+            _candidates = set(self._unfiltered_bytes)
+            _by_literal = self._by_literal_bytes
+        # One find per literal runs in C and beats a single pass of a regex alternation, which re tries literal by
+        # literal at every position anyway. find rather than in, which only looks for a single byte in an mmap.
+        for _literal, p_keys in _by_literal.items():
+            if text.find(_literal) != -1:
+                _candidates.update(p_keys)
+        return _candidates
+
+    def match(self,
+              text: str | bytes | mmap.mmap,
+              window: int = MMAP_WINDOW,
+              timed_out: list[str] | None = None) -> dict[str, tuple[int, int]]:
+        """
+        Returns pattern key -> span of the first match, for every pattern in the set that matches `text`.
+        `text` may be the raw UTF-8 bytes of a file, which are decoded (as by decode_source) once some pattern's literal
+        turns up in them, or an mmap of one, only decoded if a candidate pattern can't be matched over it as it is.
+        Spans are always character offsets into the decoded text. A mapping is decoded `window` bytes at a time where
+        possible.
+        Given a `timed_out` list, a pattern that runs past its regex budget is skipped and its key appended to the list,
+        the rest are still matched; without one, RegexBudgetExceeded is raised out of the first such pattern.
+        """
+        _candidates = self.candidates(text)
+        _matched = {}
+        if not _candidates:
+            return _matched
+
+        _compiled = self.compiled
+        _windowed: list[str] = []
+        if isinstance(text, mmap.mmap):
+            if all(self.compiled_bytes[x] is not None for x in _candidates) and _NOT_BYTES_SAFE.search(text) is None:
+                _compiled = self.compiled_bytes
+            elif all(self.margins[x] is not None for x in _candidates):
+                _windowed = [x for x in self.compiled if x in _candidates]
+                _matched.update(self._match_windowed(text, _windowed, window, timed_out))
+            else:
+                # Some pattern has to see the whole text at once
+                with PROFILER.stage("decode"):
+                    text = decode_source(text)
+        elif not isinstance(text, str):
+            # Decoding costs less than proving the bytes patterns would match the same, even with the checks in C
+            with PROFILER.stage("decode"):
+                text = decode_source(text)
+
+        _profiling = PROFILER.enabled
+        for p_key, compiled in _compiled.items():
+            if p_key not in _candidates or p_key in _windowed:
+                continue
+            try:
+                with BUDGET.guard(p_key):
+                    if _profiling:
+                        _started = time.perf_counter()
+                        _test = compiled.search(text)
+                        PROFILER.pattern(p_key, time.perf_counter() - _started, _test is not None)
+                    else:
+                        _test = compiled.search(text)
+            except RegexBudgetExceeded:
+                if timed_out is None:
+                    raise
+                timed_out.append(p_key)
+                continue
+            if _test:
+                _matched[p_key] = _test.span()
+        return {x: _matched[x] for x in self.compiled if x in _matched}
+
+    def _match_windowed(self,
+                        buffer: mmap.mmap,
+                        p_keys: list[str],
+                        window: int,
+                        timed_out: list[str] | None = None) -> dict[str, tuple[int, int]]:
+        """
+        Matches the patterns `p_keys`, all of which have a window margin, over `buffer` decoded one window at a time.
+        Budget overruns are handled as by match().
+        """
+        _matched = {}
+        _remaining = list(p_keys)
+        _profiling = PROFILER.enabled
+        _seconds = dict.fromkeys(p_keys, 0.0)
+        for _offset, _owned, _text in decoded_windows(buffer, window, max(self.margins[x] for x in p_keys)):
+            for p_key in list(_remaining):
+                try:
+                    with BUDGET.guard(p_key):
+                        _started = time.perf_counter() if _profiling else 0.0
+                        _test = self.compiled[p_key].search(_text)
+                        if _profiling:
+                            _seconds[p_key] += time.perf_counter() - _started
+                except RegexBudgetExceeded:
+                    if timed_out is None:
+                        raise
+                    timed_out.append(p_key)
+                    _remaining.remove(p_key)
+                    continue
+                # A match starting further on may not be the first one there, the next window will tell
+                if _test is not None and _test.start() < _owned:
+                    _matched[p_key] = (_offset + _test.start(), _offset + _test.end())
+                    _remaining.remove(p_key)
+            if not _remaining:
+                break
+        if _profiling:
+            for p_key in p_keys:
+                PROFILER.pattern(p_key, _seconds[p_key], p_key in _matched)
+        return _matched
@@ -0,0 +1,211 @@
+import queue
+import time
+from multiprocessing.pool import Pool
+from typing import Any, Callable, Generator, Generic, Iterable, TypeVar
+
+T = TypeVar("T")
+
+# Tasks allowed to be queued up per worker before the producer waits for results to come back
+INFLIGHT_PER_WORKER: int = 4
+
+
+class ReorderBuffer(Generic[T]):
+    """
+    Takes values tagged with a sequence number in any order and releases them in sequence order, holding on to only
+    the values that arrived ahead of a gap
+    """
+
+    def __init__(self, start: int = 0) -> None:
+        self.next_seq: int = start
+        self._held: dict[int, T] = {}
+
+    def push(self, seq: int, value: T) -> list[T]:
+        """
+        Adds a value, returns every value that is now ready to be released (possibly none)
+        """
+        self._held[seq] = value
+        _ready = []
+        while self.next_seq in self._held:
+            _ready.append(self._held.pop(self.next_seq))
+            self.next_seq += 1
+        return _ready
+
+    def __len__(self) -> int:
+        return len(self._held)
+
+
+class BoundedDispatcher:
+    """
+    Hands tasks to a pool while never letting more than `max_inflight` of them be outstanding, so that a fast producer
+    can't queue up an unbounded amount of work (and results) ahead of a slow consumer. Completed results are collected
+    in completion order.
+    Without a pool, tasks are simply run in-process as they are submitted.
+    Given a `timeout` (task -> seconds), a task that has been running for longer than that is given up on: it no longer
+    counts as in flight, any result it still produces is dropped, and it is handed back by expired(). The pool runs
+    tasks first in first out on `workers` processes, so a task is only taken to be running once fewer than `workers`
+    older tasks are outstanding, which never starts its clock early.
+    """
+
+    def __init__(self,
+                 pool: Pool | None,
+                 func: Callable[[Any], T],
+                 max_inflight: int,
+                 workers: int = 1,
+                 timeout: Callable[[Any], float] | None = None) -> None:
+        self.pool = pool
+        self.func = func
+        self.max_inflight = max(max_inflight, 1)
+        self.workers = max(workers, 1)
+        self.timeout = timeout if pool is not None else None
+        self.inflight: int = 0
+        self._done: queue.SimpleQueue = queue.SimpleQueue()
+        self._next_id: int = 0
+        # task id -> [task, time it is presumed to have started running, if it has]
+        self._outstanding: dict[int, list] = {}
+        self._expired: list[Any] = []
+
+    @property
+    def full(self) -> bool:
+        return self.inflight >= self.max_inflight
+
+    def submit(self, arg: Any) -> None:
+        _id = self._next_id
+        self._next_id += 1
+        self.inflight += 1
+        self._outstanding[_id] = [arg, None]
+        if self.pool is None:
+            try:
+                self._done.put((_id, True, self.func(arg)))
+            except Exception as e:
+                self._done.put((_id, False, e))
+            return
+
+        self.pool.apply_async(self.func, (arg,),
+                              callback=lambda x: self._done.put((_id, True, x)),
+                              error_callback=lambda e: self._done.put((_id, False, e)))
+        self._stamp()
+
+    def poll(self) -> list[T]:
+        """
+        Every result that has completed so far, without waiting
+        """
+        _results = []
+        while True:
+            try:
+                _item = self._done.get_nowait()
+            except queue.Empty:
+                break
+            if _item[0] in self._outstanding:
+                _results.append(self._unwrap(_item))
+        self._stamp()
+        self._expire()
+        return _results
+
+    def wait(self) -> list[T]:
+        """
+        Blocks until at least one outstanding task completes or is given up on, then returns every completed result
+        """
+        while self.inflight > 0:
+            self._stamp()
+            try:
+                _item = self._done.get(timeout=self._until_next_deadline())
+            except queue.Empty:
+                if self._expire():
+                    return []
+                continue
+            if _item[0] not in self._outstanding:
+                continue
+            _results = [self._unwrap(_item)]
+            _results.extend(self.poll())
+            return _results
+        return []
+
+    def expired(self) -> list[Any]:
+        """
+        The tasks given up on since the last call
+        """
+        _expired, self._expired = self._expired, []
+        return _expired
+
+    def _unwrap(self, item: tuple[int, bool, Any]) -> T:
+        _id, _ok, _value = item
+        del self._outstanding[_id]
+        self.inflight -= 1
+        if not _ok:
+            raise _value
+        return _value
+
+    def _stamp(self) -> None:
+        if self.timeout is None:
+            return
+        _now = time.monotonic()
+        for _task, _ in zip(self._outstanding.values(), range(self.workers)):
+            if _task[1] is None:
+                _task[1] = _now
+
+    def _until_next_deadline(self) -> float | None:
+        if self.timeout is None:
+            return None
+        _deadlines = [started + self.timeout(arg) for arg, started in self._outstanding.values() if started is not None]
+        if not _deadlines:
+            return None
+        return max(min(_deadlines) - time.monotonic(), 0.01)
+
+    def _expire(self) -> bool:
+        if self.timeout is None:
+            return False
+        _now = time.monotonic()
+        _overdue = [_id for _id, (arg, started) in self._outstanding.items()
+                    if started is not None and _now - started > self.timeout(arg)]
+        for _id in _overdue:
+            self._expired.append(self._outstanding.pop(_id)[0])
+            self.inflight -= 1
+        return bool(_overdue)
+
+
+class BoundedPipeline(Generic[T]):
+    """
+    Drives a BoundedDispatcher from inside a generator. submit() waits for room before handing over a task, and every
+    method yields whatever `collect` makes of each completed result, and `expire` of each task given up on, as they come
+    in. With no `expire`, a task given up on is just dropped. `abandoned` is set once any task has been given up on,
+    from then on the pool still counts it as outstanding, so it has to be terminated rather than closed and joined.
+    """
+
+    def __init__(self,
+                 pool: Pool | None,
+                 func: Callable[[Any], Any],
+                 max_inflight: int,
+                 collect: Callable[[Any], Iterable[T]],
+                 expire: Callable[[Any], Iterable[T]] | None = None,
+                 workers: int = 1,
+                 timeout: Callable[[Any], float] | None = None) -> None:
+        self.dispatcher = BoundedDispatcher(pool, func, max_inflight, workers=workers, timeout=timeout)
+        self.collect = collect
+        self.expire = expire
+        self.abandoned: bool = False
+
+    def submit(self, task: Any) -> Generator[T, None, None]:
+        while self.dispatcher.full:
+            yield from self._handle(self.dispatcher.wait())
+        self.dispatcher.submit(task)
+
+    def poll(self) -> Generator[T, None, None]:
+        """
+        Handles every result that has completed so far, without waiting
+        """
+        yield from self._handle(self.dispatcher.poll())
+
+    def drain(self) -> Generator[T, None, None]:
+        """
+        Waits for every outstanding task, including any that `expire` submits again
+        """
+        while self.dispatcher.inflight > 0:
+            yield from self._handle(self.dispatcher.wait())
+
+    def _handle(self, results: list[Any]) -> Generator[T, None, None]:
+        for _result in results:
+            yield from self.collect(_result)
+        for _task in self.dispatcher.expired():
+            self.abandoned = True
+            if self.expire is not None:
+                yield from self.expire(_task)
@@ -0,0 +1,79 @@
+import os
+import time
+from typing import Callable, Generator, Iterable, TypeVar
+
+import loguru
+
+T = TypeVar("T")
+
+SCHEDULES: tuple[str, ...] = ("size", "walk")
+
+# Small files are packed together until a chunk holds about this much source, so a dispatch is never mostly overhead
+DEFAULT_CHUNK_BYTES: int = 256 * 1024
+# Walked files sorted by size together under the "size" schedule, which bounds both how far the walk runs ahead and
+# how many finished files wait on an earlier one
+DEFAULT_LOOKAHEAD: int = 1024
+
+
+def available_cpus() -> int:
+    """
+    The number of CPUs this process may run on, honouring any affinity mask (taskset, cgroup cpusets) where the platform
+    exposes one
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return os.cpu_count() or 1
+
+
+def pack_by_size(items: Iterable[T],
+                 size_of: Callable[[T], int],
+                 max_files: int,
+                 max_bytes: int = DEFAULT_CHUNK_BYTES) -> Generator[list[T], None, None]:
+    """
+    Orders `items` largest first and packs them into chunks of at most `max_files` items, closing a chunk as soon as it
+    holds `max_bytes` or more. Large files go out first and alone, so they can't end up as the last thing one worker is
+    chewing on while the rest sit idle, and the small files at the end fill in the gaps in well packed chunks.
+    """
+    _chunk: list[T] = []
+    _bytes = 0
+    for item in sorted(items, key=size_of, reverse=True):
+        _chunk.append(item)
+        _bytes += size_of(item)
+        if len(_chunk) >= max_files or _bytes >= max_bytes:
+            yield _chunk
+            _chunk = []
+            _bytes = 0
+    if _chunk:
+        yield _chunk
+
+
+class WorkerUtilisation:
+    """
+    Tallies how long each worker process spent busy on chunks, to be compared against the wall time of the whole scan
+    """
+
+    def __init__(self) -> None:
+        self.started: float = time.perf_counter()
+        self.busy: dict[int, float] = {}
+        self.files: dict[int, int] = {}
+        self.bytes: dict[int, int] = {}
+
+    def record(self, pid: int, busy: float, files: int, size: int) -> None:
+        self.busy[pid] = self.busy.get(pid, 0.0) + busy
+        self.files[pid] = self.files.get(pid, 0) + files
+        self.bytes[pid] = self.bytes.get(pid, 0) + size
+
+    def log(self, workers: int) -> None:
+        """
+        Logs each worker's busy time, file count and bytes, and the mean utilisation over `workers` processes
+        (counting any that never got a chunk as idle throughout)
+        """
+        _wall = time.perf_counter() - self.started
+        if not self.busy or _wall <= 0:
+            return
+        loguru.logger.info(f"Worker utilisation over {_wall:.2f}s:")
+        for pid in sorted(self.busy.keys()):
+            loguru.logger.info(f"  worker {pid}: {self.busy[pid]:.2f}s busy ({self.busy[pid] / _wall:.0%}), "
+                               f"{self.files[pid]} files, {self.bytes[pid] / 2 ** 20:.1f} MiB")
+        _mean = sum(self.busy.values()) / (_wall * max(workers, len(self.busy)))
+        loguru.logger.info(f"  mean utilisation {_mean:.0%}")
@@ -0,0 +1,161 @@
+import datetime
+import json
+import sys
+import tempfile
+from typing import BinaryIO, TextIO
+
+import yaml
+
+# libyaml's emitter is an order of magnitude faster than the pure python one, use it whenever PyYAML was built with it
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+REPORT_FORMATS: tuple[str, ...] = ("yaml", "jsonl")
+
+_STD_STREAMS: dict[str, TextIO] = {
+    "stdout": sys.stdout,
+    "serr": sys.stderr
+}
+
+
+class ReportSink:
+    """
+    Receives report entries one file at a time, as they are produced, and writes them out without holding on to them.
+    Entries for a root arrive between begin(root) and end(root), but roots may overlap.
+    The base class discards everything it is given.
+    """
+
+    def begin(self, root: str) -> None:
+        pass
+
+    def write(self, root: str, name: str, entry: dict, path: str | None = None) -> None:
+        pass
+
+    def end(self, root: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class TeeReportSink(ReportSink):
+    """
+    Hands everything it is given on to each of several sinks in turn
+    """
+
+    def __init__(self, sinks: list[ReportSink]) -> None:
+        self.sinks = sinks
+
+    def begin(self, root: str) -> None:
+        for sink in self.sinks:
+            sink.begin(root)
+
+    def write(self, root: str, name: str, entry: dict, path: str | None = None) -> None:
+        for sink in self.sinks:
+            sink.write(root, name, entry, path)
+
+    def end(self, root: str) -> None:
+        for sink in self.sinks:
+            sink.end(root)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+class FileReportSink(ReportSink):
+    """
+    A sink writing to a file, opened once for the whole run, or to stdout/stderr if given "stdout" or "serr"
+    """
+
+    def __init__(self, fp: str) -> None:
+        self.fp = fp
+        self._owns_handle = fp not in _STD_STREAMS
+        self.handle: TextIO = open(fp, "w", encoding="utf-8") if self._owns_handle else _STD_STREAMS[fp]
+
+    def close(self) -> None:
+        if self._owns_handle:
+            self.handle.close()
+        else:
+            self.handle.flush()
+
+
+class YamlReportSink(FileReportSink):
+    """
+    Writes a YAML report, one commented section per root containing a mapping of file name to entry, sorted by file
+    name as yaml.safe_dump would have it.
+    Each entry is dumped as soon as it arrives into a spool file for its root, with only its name and place in the spool
+    kept in memory, and the entries are copied out of the spool into the report in name order when the root ends, so
+    roots being scanned at the same time never interleave in the output.
+    """
+
+    def __init__(self, fp: str) -> None:
+        super().__init__(fp)
+        self.handle.write(f"# ----- BEGIN QRPARSE TEST {datetime.datetime.now()} ------\n")
+        self._spools: dict[str, BinaryIO] = {}
+        # root -> [(file name, offset into the spool, length)]
+        self._index: dict[str, list[tuple[str, int, int]]] = {}
+
+    def begin(self, root: str) -> None:
+        if root not in self._spools:
+            self._spools[root] = tempfile.TemporaryFile("w+b")
+            self._index[root] = []
+
+    def write(self, root: str, name: str, entry: dict, path: str | None = None) -> None:
+        self.begin(root)
+        _dumped = yaml.dump({name: entry}, Dumper=YamlDumper, default_flow_style=False).encode("utf-8")
+        _spool = self._spools[root]
+        self._index[root].append((name, _spool.tell(), len(_dumped)))
+        _spool.write(_dumped)
+
+    def end(self, root: str) -> None:
+        self.begin(root)
+        _spool = self._spools.pop(root)
+        _index = self._index.pop(root)
+        self.handle.write(f"# ----- BEGIN {root} REPORT ------\n")
+        if not _index:
+            self.handle.write("{}\n")
+        for _, offset, length in sorted(_index):
+            _spool.seek(offset)
+            self.handle.write(_spool.read(length).decode("utf-8"))
+        _spool.close()
+        self.handle.write(f"# ----- END {root} REPORT ------\n\n")
+        self.handle.flush()
+
+    def close(self) -> None:
+        for _spool in self._spools.values():
+            _spool.close()
+        self._spools = {}
+        self._index = {}
+        super().close()
+
+
+class JsonLinesReportSink(FileReportSink):
+    """
+    Writes one JSON object per line per file, tagged with its root, straight through as entries arrive
+    """
+
+    def write(self, root: str, name: str, entry: dict, path: str | None = None) -> None:
+        _record = {"root": root, "file": name, "report": entry}
+        if path is not None:
+            _record["path"] = path
+        self.handle.write(json.dumps(_record, sort_keys=True))
+        self.handle.write("\n")
+
+
+def open_report_sink(fp: str | None, fmt: str = "yaml") -> ReportSink:
+    """
+    Opens the sink for the given output and format, a sink discarding everything if there is no output
+    """
+    if fp is None:
+        return ReportSink()
+    if fmt == "yaml":
+        return YamlReportSink(fp)
+    if fmt == "jsonl":
+        return JsonLinesReportSink(fp)
+    raise ValueError(f"Unknown report format {fmt}, expected one of {REPORT_FORMATS}")
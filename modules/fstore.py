@@ -0,0 +1,219 @@
+import argparse
+import datetime
+import pathlib
+import sqlite3
+import sys
+
+import loguru
+
+from modules.fsink import ReportSink
+
+SCHEMA_VERSION: int = 1
+
+_SCHEMA: tuple[str, ...] = (
+    "CREATE TABLE IF NOT EXISTS runs ("
+    "id INTEGER PRIMARY KEY, "
+    "started TEXT NOT NULL, "
+    "finished TEXT)",
+    "CREATE TABLE IF NOT EXISTS roots ("
+    "id INTEGER PRIMARY KEY, "
+    "run_id INTEGER NOT NULL REFERENCES runs (id), "
+    "name TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS files ("
+    "id INTEGER PRIMARY KEY, "
+    "run_id INTEGER NOT NULL REFERENCES runs (id), "
+    "root_id INTEGER NOT NULL REFERENCES roots (id), "
+    "path TEXT NOT NULL, "
+    "name TEXT NOT NULL, "
+    "relevance_type TEXT NOT NULL, "
+    "matched_string TEXT, "
+    "special_notes TEXT)",
+    "CREATE TABLE IF NOT EXISTS fields ("
+    "file_id INTEGER NOT NULL REFERENCES files (id), "
+    "field TEXT NOT NULL, "
+    "used INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS roots_run ON roots (run_id)",
+    "CREATE INDEX IF NOT EXISTS files_run_path ON files (run_id, path)",
+    "CREATE INDEX IF NOT EXISTS files_name ON files (name)",
+    "CREATE INDEX IF NOT EXISTS fields_file ON fields (file_id, used)",
+    "CREATE INDEX IF NOT EXISTS fields_field ON fields (field)",
+)
+
+# Every unused field of a run, as (root, path, relevance type, field)
+_UNUSED_IN_RUN: str = ("SELECT r.name, f.path, f.relevance_type, fl.field "
+                       "FROM files f "
+                       "JOIN roots r ON r.id = f.root_id "
+                       "JOIN fields fl ON fl.file_id = f.id AND fl.used = 0 "
+                       "WHERE f.run_id = ?")
+
+
+def connect(db_path: str | pathlib.Path) -> sqlite3.Connection:
+    """
+    Opens the store, creating the tables on first use
+    """
+    _db = sqlite3.connect(db_path)
+    _db.execute("PRAGMA journal_mode=WAL")
+    _db.execute("PRAGMA foreign_keys=ON")
+    _version = _db.execute("PRAGMA user_version").fetchone()[0]
+    if _version not in (0, SCHEMA_VERSION):
+        _db.close()
+        raise RuntimeError(f"{db_path} has result store schema version {_version}, expected {SCHEMA_VERSION}")
+    for _statement in _SCHEMA:
+        _db.execute(_statement)
+    _db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    _db.commit()
+    return _db
+
+
+class ResultStoreSink(ReportSink):
+    """
+    Records a run's report entries in an indexed SQLite database, one row per file and relevance type and one row per
+    instance field, so that results can be queried and compared across runs without parsing any reports.
+    Each root is committed as it ends.
+    """
+
+    def __init__(self, db_path: str | pathlib.Path) -> None:
+        self.db_path = db_path
+        self._db = connect(db_path)
+        self.run_id: int = self._db.execute("INSERT INTO runs (started) VALUES (?)",
+                                            (datetime.datetime.now().isoformat(),)).lastrowid
+        self._roots: dict[str, int] = {}
+        self._db.commit()
+
+    def begin(self, root: str) -> None:
+        if root not in self._roots:
+            self._roots[root] = self._db.execute("INSERT INTO roots (run_id, name) VALUES (?, ?)",
+                                                 (self.run_id, root)).lastrowid
+
+    def write(self, root: str, name: str, entry: dict, path: str | None = None) -> None:
+        self.begin(root)
+        for relevance_type, _report in entry.items():
+            _notes = _report.get("special notes")
+            _file_id = self._db.execute("INSERT INTO files (run_id, root_id, path, name, relevance_type, "
+                                        "matched_string, special_notes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        (self.run_id, self._roots[root], path if path is not None else name, name,
+                                         relevance_type, _report.get("matched string"),
+                                         "\n".join(_notes) if _notes else None)).lastrowid
+            self._db.executemany("INSERT INTO fields (file_id, field, used) VALUES (?, ?, ?)",
+                                 [(_file_id, x, 1) for x in _report.get("used", [])]
+                                 + [(_file_id, x, 0) for x in _report.get("unused", [])])
+
+    def end(self, root: str) -> None:
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.execute("UPDATE runs SET finished = ? WHERE id = ?",
+                         (datetime.datetime.now().isoformat(), self.run_id))
+        self._db.commit()
+        self._db.close()
+        loguru.logger.info(f"Recorded run {self.run_id} in {self.db_path}")
+
+
+def list_runs(db: sqlite3.Connection) -> list[tuple]:
+    """
+    (id, started, finished, files, unused fields) for every run, oldest first
+    """
+    return db.execute("SELECT r.id, r.started, r.finished, "
+                      "(SELECT COUNT(*) FROM files f WHERE f.run_id = r.id), "
+                      "(SELECT COUNT(*) FROM files f JOIN fields fl ON fl.file_id = f.id AND fl.used = 0 "
+                      " WHERE f.run_id = r.id) "
+                      "FROM runs r ORDER BY r.id").fetchall()
+
+
+def resolve_run(db: sqlite3.Connection, run: int | None = None, before: str | None = None) -> int:
+    """
+    The given run id, the last run started before `before` (an ISO date or timestamp) or failing both the latest run
+    """
+    if run is not None:
+        _row = db.execute("SELECT id FROM runs WHERE id = ?", (run,)).fetchone()
+    elif before is not None:
+        _row = db.execute("SELECT id FROM runs WHERE started < ? ORDER BY id DESC LIMIT 1", (before,)).fetchone()
+    else:
+        _row = db.execute("SELECT id FROM runs ORDER BY id DESC LIMIT 1").fetchone()
+    if _row is None:
+        raise LookupError(f"No such run (run={run}, before={before})")
+    return _row[0]
+
+
+def unused_fields(db: sqlite3.Connection, run_id: int, root: str | None = None) -> list[tuple]:
+    """
+    (root, path, relevance type, field) for every field reported unused in a run
+    """
+    if root is None:
+        return db.execute(_UNUSED_IN_RUN + " ORDER BY 1, 2, 3, 4", (run_id,)).fetchall()
+    return db.execute(_UNUSED_IN_RUN + " AND r.name = ? ORDER BY 1, 2, 3, 4", (run_id, root)).fetchall()
+
+
+def diff_runs(db: sqlite3.Connection, old_run: int, new_run: int) -> tuple[list[tuple], list[tuple]]:
+    """
+    The unused fields that appeared between two runs and those that went away, as (root, path, relevance type, field)
+    """
+    _gained = db.execute(f"{_UNUSED_IN_RUN} EXCEPT {_UNUSED_IN_RUN} ORDER BY 1, 2, 3, 4",
+                         (new_run, old_run)).fetchall()
+    _lost = db.execute(f"{_UNUSED_IN_RUN} EXCEPT {_UNUSED_IN_RUN} ORDER BY 1, 2, 3, 4",
+                       (old_run, new_run)).fetchall()
+    return _gained, _lost
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m modules.fstore',
+        description='Query the result store written by main.py --db')
+    parser.add_argument('db', type=str)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('runs', help='List the recorded runs')
+
+    _unused = commands.add_parser('unused', help='List the fields reported unused in a run')
+    _unused.add_argument('--run', type=int, help='Run id, the latest run by default')
+    _unused.add_argument('--root', type=str, help='Only this root (project directory name)')
+
+    _diff = commands.add_parser('diff', help='Unused fields gained (+) and lost (-) between two runs')
+    _diff.add_argument('old', type=int, nargs='?', help='Run id, the run before NEW by default')
+    _diff.add_argument('new', type=int, nargs='?', help='Run id, the latest run by default')
+    _diff.add_argument('--since', type=str, metavar='DATE',
+                       help='Compare against the last run started before this ISO date instead of OLD')
+
+    args = parser.parse_args(argv)
+    if not pathlib.Path(args.db).exists():
+        print(f"No result store at {args.db}", file=sys.stderr)
+        return 1
+    db = connect(args.db)
+
+    try:
+        if args.command == 'runs':
+            for _run in list_runs(db):
+                print("\t".join("" if x is None else str(x) for x in _run))
+
+        elif args.command == 'unused':
+            for _row in unused_fields(db, resolve_run(db, args.run), args.root):
+                print("\t".join(_row))
+
+        elif args.command == 'diff':
+            _new = resolve_run(db, args.new)
+            if args.since is not None:
+                _old = resolve_run(db, before=args.since)
+            elif args.old is not None:
+                _old = resolve_run(db, args.old)
+            else:
+                _row = db.execute("SELECT id FROM runs WHERE id < ? ORDER BY id DESC LIMIT 1", (_new,)).fetchone()
+                if _row is None:
+                    raise LookupError(f"No run before run {_new} to compare against")
+                _old = _row[0]
+
+            _gained, _lost = diff_runs(db, _old, _new)
+            print(f"# run {_old} -> run {_new}: {len(_gained)} gained, {len(_lost)} lost")
+            for _row in _gained:
+                print("+\t" + "\t".join(_row))
+            for _row in _lost:
+                print("-\t" + "\t".join(_row))
+    except LookupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
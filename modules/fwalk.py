@@ -0,0 +1,205 @@
+import fnmatch
+import os
+import pathlib
+import re
+from typing import Generator, Iterable
+
+import loguru
+
+# Generated sources, VCS metadata and dependency trees, which in Maven/Gradle checkouts make up most of the inodes
+DEFAULT_EXCLUDES: tuple[str, ...] = (
+    ".git",
+    ".hg",
+    ".svn",
+    ".idea",
+    ".gradle",
+    "node_modules",
+    "generated-sources",
+    "generated-test-sources",
+)
+# Build output directories, only pruned next to one of the BUILD_FILES, as the same names are fair game for packages
+DEFAULT_BUILD_OUTPUTS: tuple[str, ...] = ("target", "build")
+BUILD_FILES: frozenset[str] = frozenset(("pom.xml", "build.gradle", "build.gradle.kts", "settings.gradle",
+                                         "settings.gradle.kts", "build.xml"))
+
+
+class WalkEntry:
+    """
+    A file found by the walker, with the size and mtime from the directory scan already attached
+    """
+
+    def __init__(self, path: str, name: str, size: int, mtime_ns: int) -> None:
+        self.path = path
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def __repr__(self) -> str:
+        return f"WalkEntry({self.path!r}, size={self.size})"
+
+
+def compile_globs(globs: Iterable[str]) -> re.Pattern | None:
+    """
+    Folds a set of fnmatch style globs into a single regex, None if there are no globs
+    """
+    _globs = list(globs)
+    if not _globs:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(x)})" for x in _globs))
+
+
+class GitIgnoreRule:
+    """
+    One line of a .gitignore file. Supports the common subset of the format: comments, negation, directory-only rules,
+    anchored rules (containing a '/') and the '*', '?', '**' and '[...]' wildcards.
+    """
+
+    def __init__(self, line: str) -> None:
+        self.negate = line.startswith("!")
+        if self.negate:
+            line = line[1:]
+        self.dir_only = line.endswith("/")
+        line = line.strip("/") if self.dir_only else line
+        self.anchored = "/" in line
+        line = line.lstrip("/")
+        self.regex = re.compile(self._translate(line) + r"\Z")
+
+    @staticmethod
+    def _translate(glob: str) -> str:
+        _out = []
+        i = 0
+        while i < len(glob):
+            _c = glob[i]
+            if glob.startswith("**/", i):
+                _out.append("(?:.*/)?")
+                i += 3
+                continue
+            if glob.startswith("**", i):
+                _out.append(".*")
+                i += 2
+                continue
+            if _c == "*":
+                _out.append("[^/]*")
+            elif _c == "?":
+                _out.append("[^/]")
+            elif _c == "[":
+                _end = glob.find("]", i + 1)
+                if _end == -1:
+                    _out.append(re.escape(_c))
+                else:
+                    _out.append(glob[i:_end + 1])
+                    i = _end
+            else:
+                _out.append(re.escape(_c))
+            i += 1
+        return "".join(_out)
+
+    def matches(self, rel_path: str, name: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.match(rel_path if self.anchored else name) is not None
+
+
+def read_gitignore(directory: str) -> list[GitIgnoreRule]:
+    try:
+        with open(os.path.join(directory, ".gitignore"), "r", encoding="utf-8") as h:
+            _lines = h.read().splitlines()
+    except OSError:
+        return []
+
+    _rules = []
+    for _line in _lines:
+        _line = _line.rstrip()
+        if not _line or _line.startswith("#"):
+            continue
+        _rules.append(GitIgnoreRule(_line))
+    return _rules
+
+
+def _gitignored(stack: list[tuple[str, list[GitIgnoreRule]]], rel_path: str, name: str, is_dir: bool) -> bool:
+    """
+    Checks a path against every .gitignore between the walk root and the path, the last matching rule wins
+    """
+    _ignored = False
+    for _base, rules in stack:
+        _rel = rel_path[len(_base) + 1:] if _base else rel_path
+        for rule in rules:
+            if rule.matches(_rel, name, is_dir):
+                _ignored = not rule.negate
+    return _ignored
+
+
+def walk(root: str | pathlib.Path,
+         extension: str,
+         excludes: Iterable[str] = DEFAULT_EXCLUDES,
+         gitignore: bool = False,
+         build_outputs: Iterable[str] = DEFAULT_BUILD_OUTPUTS) -> Generator[WalkEntry, None, None]:
+    """
+    Walks `root` with os.scandir and yields every file whose name ends with `extension`.
+    Directories and files matching any of the `excludes` globs (checked against both the name and the path relative to
+    `root`) are pruned without being descended into, as is anything ignored by a .gitignore when `gitignore` is set.
+    Directories named in `build_outputs` are pruned too, but only where a build file (pom.xml, build.gradle, ...) sits
+    beside them, so a package that happens to be called build is still walked. Everything pruned is logged at debug.
+    Files come out in the same order as pathlib's "**/*" globbing: a directory's files, then its subdirectories in
+    turn. Symlinked directories are not followed.
+    """
+    _exclude = compile_globs(excludes)
+    _build_outputs = frozenset(build_outputs)
+    _root = os.fspath(root)
+    # (absolute dir, dir relative to root, .gitignore rules in effect)
+    _stack: list[tuple[str, str, list[tuple[str, list[GitIgnoreRule]]]]] = [(_root, "", [])]
+
+    while _stack:
+        _dir, _rel_dir, _ignores = _stack.pop()
+        if gitignore:
+            _rules = read_gitignore(_dir)
+            if _rules:
+                _ignores = _ignores + [(_rel_dir, _rules)]
+
+        _subdirs = []
+        _has_build_file = False
+        try:
+            with os.scandir(_dir) as it:
+                for entry in it:
+                    _name = entry.name
+                    _rel = f"{_rel_dir}/{_name}" if _rel_dir else _name
+                    if _exclude is not None and (_exclude.match(_name) or _exclude.match(_rel)):
+                        loguru.logger.debug(f"Pruned excluded {entry.path}")
+                        continue
+                    if _name in BUILD_FILES:
+                        _has_build_file = True
+
+                    try:
+                        _is_dir = entry.is_dir()
+                        if _is_dir:
+                            if entry.is_symlink():
+                                continue
+                            if gitignore and _gitignored(_ignores, _rel, _name, True):
+                                continue
+                            _subdirs.append((entry.path, _rel, _ignores))
+                            continue
+
+                        if not _name.endswith(extension) or not entry.is_file():
+                            continue
+                        if gitignore and _gitignored(_ignores, _rel, _name, False):
+                            continue
+                        _stat = entry.stat()
+                    except OSError as e:
+                        loguru.logger.warning(f"Skipping {entry.path}: {e}")
+                        continue
+
+                    yield WalkEntry(entry.path, _name, _stat.st_size, _stat.st_mtime_ns)
+        except OSError as e:
+            loguru.logger.warning(f"Could not scan directory {_dir}: {e}")
+            continue
+
+        if _has_build_file and _build_outputs:
+            # Whether a directory is build output is only known once the whole of its parent has been listed
+            _kept = []
+            for _subdir in _subdirs:
+                if os.path.basename(_subdir[0]) in _build_outputs:
+                    loguru.logger.debug(f"Pruned build output {_subdir[0]}")
+                else:
+                    _kept.append(_subdir)
+            _subdirs = _kept
+        _stack.extend(reversed(_subdirs))
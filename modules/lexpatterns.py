@@ -1,10 +1,21 @@
+import bisect
+import itertools
+import operator
+import re
+from array import array
 from enum import Enum
 from abc import ABC
-from typing import Any, Callable, Self, Iterable
+from typing import Any, Callable, Self, Iterable, Generator
 
 import loguru
+from pygments.token import string_to_tokentype
 from modules.meta import McSingleton
 
+try:
+    import numpy
+except ImportError:  # optional, TokenTable queries fall back to plain python loops without it
+    numpy = None
+
 
 class TokenEnum(Enum):
     pass
@@ -72,6 +83,11 @@ class CommentToken(LexToken):
         self.flavour = "Comment"
 
 
+class CommentUnflavoured(CommentToken):
+    def __init__(self, position: tuple[int, int]):
+        super().__init__(position)
+
+
 class CommentMultiline(CommentToken):
     def __init__(self, position: tuple[int, int]):
         super().__init__(position)
@@ -135,6 +151,11 @@ class LiteralToken(LexToken):
         self.flavour = "Literal"
 
 
+class LiteralUnflavoured(LiteralToken):
+    def __init__(self, position: tuple[int, int]):
+        super().__init__(position)
+
+
 class LiteralNumber(LiteralToken):
     flavour_subtype: str = None
 
@@ -149,6 +170,11 @@ class LiteralString(LiteralToken):
         self.flavour_type = "String"
 
 
+class LiteralNumberUnflavoured(LiteralNumber):
+    def __init__(self, position: tuple[int, int]):
+        super().__init__(position)
+
+
 class LiteralInteger(LiteralNumber):
     def __init__(self, position: tuple[int, int]):
         super().__init__(position)
@@ -247,10 +273,30 @@ class KeywordConstant(KeywordToken):
         self.flavour_type = "Constant"
 
 
+class TokenUnflavoured(LexToken):
+    """
+    Stands in for any token type with no flavour of LexToken of its own, such as Token.Error
+    """
+
+    def __init__(self, position: tuple[int, int]):
+        super().__init__(position)
+
+
 class TokenFactory(metaclass=McSingleton):
+    """
+    Makes LexToken descendants out of pygments tokens. There is one factory per process, so everything about the file
+    being fed (its position, and the tokens generated from it, if `retain` is set) is reset at the start of every file
+    by feed_stream, or by calling reset.
+    """
     generated: list[LexToken] = None
     line_number: int = None
     char_number: int = None
+    # Whether fed tokens are kept in `generated`, until the next reset
+    retain: bool = None
+    # Whether token types missing from l1_lookup are an error, rather than made into their nearest unflavoured ancestor
+    strict: bool = None
+    # pygments token type -> the LexToken descendant its tokens are made into
+    dispatch_table: dict[Any, Callable] = None
     l1_lookup: dict = {
         "Keyword": {
             "Namespace": KeywordNamespace,
@@ -270,6 +316,7 @@ class TokenFactory(metaclass=McSingleton):
         "Comment": {
             "Multiline": CommentMultiline,
             "Single": CommentSingle,
+            "%UNFLAVOURED%": CommentUnflavoured,
         },
         "Text": {
             "Whitespace": TextWhitespace,
@@ -287,9 +334,12 @@ class TokenFactory(metaclass=McSingleton):
                 "Hex": LiteralHex,
                 "Bin": LiteralBin,
                 "Float": LiteralFloat,
+                "%UNFLAVOURED%": LiteralNumberUnflavoured,
             },
-            "String": LiteralString
+            "String": LiteralString,
+            "%UNFLAVOURED%": LiteralUnflavoured,
         },
+        "%UNFLAVOURED%": TokenUnflavoured,
     }
 
     def __init__(self) -> None:
@@ -299,6 +349,33 @@ class TokenFactory(metaclass=McSingleton):
             self.line_number = 0
         if self.char_number is None:
             self.char_number = 0
+        if self.retain is None:
+            self.retain = False
+        if self.strict is None:
+            self.strict = False
+        if self.dispatch_table is None:
+            self.dispatch_table = {}
+
+    def reset(self) -> None:
+        """
+        Forgets the file fed so far, back to the first line and column and with nothing generated
+        """
+        self.generated = []
+        self.line_number = 0
+        self.char_number = 0
+
+    def set_retain(self, retain: bool) -> None:
+        """
+        With `retain` set, every token fed is also kept in `generated` until the next reset
+        """
+        self.retain = retain
+
+    def set_strict(self, strict: bool) -> None:
+        """
+        With `strict` set, tokens of types missing from l1_lookup raise a KeyError rather than falling back
+        """
+        self.strict = strict
+        self.dispatch_table = {}
 
     def feed(self, token: tuple) -> LexToken:
         """
@@ -306,51 +383,259 @@ class TokenFactory(metaclass=McSingleton):
         Give me a big juicy tasty lexed token and I will make an uwu LexToken descendant (a class that inherits
         LexToken) that u can use for fun things
         """
-        _token_type_name: str = str(token[0])
-        _token_str: str = token[1]
-
-        _token_type_descendents: list[str] = _token_type_name.split(".")
-        assert _token_type_descendents.pop(0) == "Token"
-
-        _lookup: dict | Callable = self.l1_lookup[_token_type_descendents.pop(0)]
-        while type(_lookup) is dict:
-            # Only breaks when lookup popping returns a callable
-            try:
-                _lookup = _lookup[_token_type_descendents.pop(0)]
-            except KeyError as e:
-                loguru.logger.error(f"No lookup entry found for token {_token_type_name}"
-                                    f"@L{self.line_number}:{self.char_number}")
-                raise e
-            except IndexError as e:
-                if "%UNFLAVOURED%" in _lookup:
-                    break
-                else:
-                    loguru.logger.error(f"No resolving callable for token classifier stream {_token_type_name}"
-                                        f"@L{self.line_number}:{self.char_number}")
-                    raise e
-
-        if type(_lookup) is dict:
-            if "%UNFLAVOURED%" in _lookup:
-                _lookup = _lookup["%UNFLAVOURED%"]
-            else:
-                loguru.logger.error(f"Exhausted token classifier stream but didn't "
-                                    f"resolve a callable: {_token_type_name}")
+        _token_type, _token_str = token
+        _lookup = self.dispatch_table.get(_token_type)
+        if _lookup is None:
+            _lookup = self.dispatch(_token_type)
 
         # Create and set token object from lookup and misc properties
         _token_obj: LexToken = _lookup((self.line_number, self.char_number))
-        _token_obj.set_token_type(token[0]).set_token_string(_token_str)
+        _token_obj.token_type = _token_type
+        _token_obj.token_string = _token_str
         # Keep track of position in the file
         _newlines = _token_str.count("\n")
 
         if _newlines > 0:
             self.line_number += _newlines
-            self.char_number = 0
+            # Whatever follows the last newline is on the new line already
+            self.char_number = len(_token_str) - _token_str.rindex("\n") - 1
         else:
             self.char_number += len(_token_str)
 
-        self.generated.append(_token_obj)
+        if self.retain:
+            self.generated.append(_token_obj)
         return _token_obj
 
+    def feed_stream(self, token_stream: Iterable[tuple]) -> Generator[LexToken, None, None]:
+        """
+        Feeds every token of one file, starting from a clean slate
+        """
+        self.reset()
+        for token in token_stream:
+            yield self.feed(token)
+
+    def dispatch(self, token_type: Any) -> Callable:
+        """
+        The LexToken descendant that tokens of the pygments token type `token_type` are made into, resolved once per type
+        and then served from dispatch_table
+        """
+        _lookup = self.dispatch_table.get(token_type)
+        if _lookup is None:
+            _lookup = self.dispatch_table[token_type] = self.resolve(str(token_type))
+        return _lookup
+
+    def resolve(self, _token_type_name: str) -> Callable:
+        """
+        The LexToken descendant that tokens of the pygments token type named `_token_type_name` are made into.
+        The name is followed down l1_lookup as far as it goes. If it runs out on a callable, that is the answer, and if
+        it runs out on a table, that table's %UNFLAVOURED% entry is. A type that leads off the edge of the tables, or
+        runs out on a table without one, gets the %UNFLAVOURED% entry of its nearest ancestor that has one (down to
+        TokenUnflavoured), with a warning, or a KeyError when the factory is strict.
+        """
+        _token_type_descendents: list[str] = _token_type_name.split(".")
+        assert _token_type_descendents[0] == "Token"
+
+        _lookup: dict | Callable = self.l1_lookup
+        _unflavoured: Callable = self.l1_lookup["%UNFLAVOURED%"]
+        for _descendent in _token_type_descendents[1:]:
+            if "%UNFLAVOURED%" in _lookup:
+                _unflavoured = _lookup["%UNFLAVOURED%"]
+            if _descendent not in _lookup:
+                break
+            _lookup = _lookup[_descendent]
+            if type(_lookup) is not dict:
+                return _lookup
+        else:
+            if "%UNFLAVOURED%" in _lookup:
+                return _lookup["%UNFLAVOURED%"]
+
+        if self.strict:
+            loguru.logger.error(f"No lookup entry found for token {_token_type_name}")
+            raise KeyError(_token_type_name)
+        loguru.logger.warning(f"No lookup entry found for token {_token_type_name}, "
+                              f"making it a {_unflavoured.__name__}")
+        return _unflavoured
+
+
+_NEWLINE: re.Pattern = re.compile("\n")
+
+
+class TokenTable:
+    """
+    Every token of one lexed source, held column-wise rather than as one LexToken per token: parallel arrays of kind
+    ids, start offsets, lengths, lines and columns (0 based, only worked out when first asked for), with each token's
+    text a slice of `source`, the text as the lexer saw it (pygments normalises line endings and strips leading and
+    trailing blank lines).
+    Kinds are the names of pygments token types, numbered in order of first appearance within the table, so a table
+    pickles as it is and means the same in any process.
+    Indexing or iterating over the table makes LexToken objects on demand, and where() and offsets() find tokens by kind
+    and text in one pass over the arrays (vectorised with numpy, when it is installed).
+    """
+
+    def __init__(self) -> None:
+        self.source: str = ""
+        self.kind_names: list[str] = []
+        self.kind_ids: dict[str, int] = {}
+        self.kinds: array = array("H")
+        self.starts: array = array("I")
+        self.lengths: array = array("I")
+        # Worked out from the starts on first use, most queries never need them
+        self._lines: array | None = None
+        self._columns: array | None = None
+
+    @classmethod
+    def from_stream(cls, token_stream: Iterable[tuple]) -> Self:
+        """
+        Builds a table from a stream of pygments (token type, text) pairs. The columns are built with map/accumulate
+        over the whole stream rather than token by token in python.
+        """
+        _table = cls()
+        _pairs = list(token_stream)
+        if not _pairs:
+            return _table
+        _types, _texts = zip(*_pairs)
+        del _pairs
+
+        # Token types are singletons, and ids hash a good deal quicker than the tuples they are
+        _kind_ids = {x: _table._intern(str(x)) for x in {id(t): t for t in _types}.values()}
+        _by_id = {id(k): v for k, v in _kind_ids.items()}
+        _table.kinds = array("H", map(_by_id.__getitem__, map(id, _types)))
+        _table.lengths = array("I", map(len, _texts))
+        _table.starts = array("I", itertools.accumulate(_table.lengths, initial=0))
+        _table.starts.pop()
+        _table.source = "".join(_texts)
+        return _table
+
+    @property
+    def lines(self) -> array:
+        if self._lines is None:
+            self._locate()
+        return self._lines
+
+    @property
+    def columns(self) -> array:
+        if self._columns is None:
+            self._locate()
+        return self._columns
+
+    def _locate(self) -> None:
+        """
+        The line of each token is the number of newlines before it, its column its distance from the start of that line
+        """
+        _line_starts = array("I", [0])
+        _line_starts.extend(x.end() for x in _NEWLINE.finditer(self.source))
+        if numpy is not None:
+            _line_starts_view = numpy.frombuffer(_line_starts, dtype=numpy.uint32)
+            _starts = numpy.frombuffer(self.starts, dtype=numpy.uint32)
+            _lines = (numpy.searchsorted(_line_starts_view, _starts, side="right") - 1).astype(numpy.uint32)
+            self._lines = array("I", _lines.tobytes())
+            self._columns = array("I", (_starts - _line_starts_view[_lines]).tobytes())
+            return
+        self._lines = array("I", map(operator.sub,
+                                     map(bisect.bisect_right, itertools.repeat(_line_starts), self.starts),
+                                     itertools.repeat(1)))
+        self._columns = array("I", map(operator.sub, self.starts, map(_line_starts.__getitem__, self._lines)))
+
+    def _intern(self, kind_name: str) -> int:
+        _kind = self.kind_ids.get(kind_name)
+        if _kind is None:
+            _kind = self.kind_ids[kind_name] = len(self.kind_names)
+            self.kind_names.append(kind_name)
+        return _kind
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, idx: int | slice) -> LexToken | list[LexToken]:
+        if isinstance(idx, slice):
+            return [self.token(x) for x in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("token index out of range")
+        return self.token(idx)
+
+    def __iter__(self) -> Generator[LexToken, None, None]:
+        for idx in range(len(self)):
+            yield self.token(idx)
+
+    def stream(self) -> Generator[tuple[Any, str], None, None]:
+        """
+        The table as the stream of pygments (token type, text) pairs it was built from
+        """
+        _types = [string_to_tokentype(x) for x in self.kind_names]
+        for _kind, _start, _length in zip(self.kinds, self.starts, self.lengths):
+            yield _types[_kind], self.source[_start:_start + _length]
+
+    def kind(self, idx: int) -> str:
+        return self.kind_names[self.kinds[idx]]
+
+    def text(self, idx: int) -> str:
+        _start = self.starts[idx]
+        return self.source[_start:_start + self.lengths[idx]]
+
+    def token(self, idx: int) -> LexToken:
+        """
+        The token at `idx` as a LexToken, made afresh on every call
+        """
+        _type = string_to_tokentype(self.kind(idx))
+        _token: LexToken = TokenFactory().dispatch(_type)((self.lines[idx], self.columns[idx]))
+        _token.token_type = _type
+        _token.token_string = self.text(idx)
+        return _token
+
+    def _kind_query(self, kind: str | TokenEnum | Any, subtypes: bool) -> list[int]:
+        if isinstance(kind, TokenEnum):
+            kind = kind.value
+        _name = str(kind)
+        if not subtypes:
+            return [self.kind_ids[_name]] if _name in self.kind_ids else []
+        return [x for x, name in enumerate(self.kind_names) if name == _name or name.startswith(_name + ".")]
+
+    def where(self, kind: str | TokenEnum | Any = None, text: str | None = None, subtypes: bool = False):
+        """
+        The indexes of every token of `kind` (a TokenTypes member, a pygments token type or its name, and with
+        `subtypes` any of its subtypes too) whose text is `text`, either left as None to match anything. A TokenUStreams
+        member gives both at once. Comes back as a numpy array when numpy is installed, an array('I') otherwise.
+        """
+        if isinstance(kind, TokenUStreams):
+            kind, text = kind.value
+        _kinds = None if kind is None else self._kind_query(kind, subtypes)
+        if _kinds == []:
+            return numpy.empty(0, dtype=numpy.intp) if numpy is not None else array("I")
+
+        if numpy is not None:
+            _mask = numpy.ones(len(self), dtype=bool)
+            if _kinds is not None:
+                _mask &= numpy.isin(numpy.frombuffer(self.kinds, dtype=numpy.uint16), _kinds)
+            if text is not None:
+                _mask &= numpy.frombuffer(self.lengths, dtype=numpy.uint32) == len(text)
+            _idx = numpy.flatnonzero(_mask)
+            if text is not None and len(_idx):
+                _starts = numpy.frombuffer(self.starts, dtype=numpy.uint32)[_idx].tolist()
+                _idx = _idx[numpy.fromiter((self.source.startswith(text, x) for x in _starts), dtype=bool,
+                                           count=len(_starts))]
+            return _idx
+
+        _kind_set = None if _kinds is None else set(_kinds)
+        _length = None if text is None else len(text)
+        _source = self.source
+        return array("I", (idx for idx, (k, start, length) in enumerate(zip(self.kinds, self.starts, self.lengths))
+                           if (_kind_set is None or k in _kind_set)
+                           and (_length is None or (length == _length and _source.startswith(text, start)))))
+
+    def offsets(self,
+                kind: str | TokenEnum | Any = None,
+                text: str | None = None,
+                subtypes: bool = False) -> list[int]:
+        """
+        The start offsets into `source` of every token where() finds
+        """
+        _idx = self.where(kind, text, subtypes)
+        if numpy is not None:
+            return numpy.frombuffer(self.starts, dtype=numpy.uint32)[_idx].tolist()
+        return [self.starts[x] for x in _idx]
+
 
 class TokenGroup(ABC):
     tokens: list[LexToken] = None
@@ -378,12 +663,13 @@ class TokenLine(TokenGroup):
 
 
 class ParseLexStream:
-    def __init__(self, token_stream: Iterable) -> None:
+    def __init__(self, token_stream: Iterable | TokenTable) -> None:
         self._tok_stream = token_stream
-        self.parsed_tokens = []
-        _factory = TokenFactory()
-        for tok in self._tok_stream:
-            self.parsed_tokens.append(_factory.feed(tok))
+        # A table that was already built, by a lexing worker say, is taken as it is
+        self.table: TokenTable = token_stream if isinstance(token_stream, TokenTable) \
+            else TokenTable.from_stream(self._tok_stream)
+        # LexToken objects are only made as they are asked for
+        self.parsed_tokens: TokenTable = self.table
 
-        loguru.logger.info(f"Transposed lex stream into objects")
+        loguru.logger.info(f"Transposed lex stream into a table of {len(self.table)} tokens")
         # print(self.parsed_tokens)
\ No newline at end of file
@@ -1,20 +1,39 @@
+import argparse
 import loguru
 
 import modules.flex as lex
 import modules.lexpatterns as lp
 from dotenv import load_dotenv
 import os
+from pygments.util import ClassNotFound
 
 load_dotenv()
 
-_inst = lex.LexFileGenerator(path=os.environ["EVOTING_PATH"], source_file_ext=".java")
+parser = argparse.ArgumentParser(description='Lexes every source file under EVOTING_PATH and parses its tokens')
+parser.add_argument('--ext', type=str, default=".java",
+                    help='Extension of the source files to lex')
+parser.add_argument('--lexer', type=str, default=None,
+                    help='Name or alias of the pygments lexer to lex every file with, instead of resolving one from '
+                         'the extension')
+parser.add_argument('-n', '--processes', type=int, default=1,
+                    help='Number of processes to lex with (0 for as many as there are CPUs available)')
+parser.add_argument('--as-completed', action='store_true',
+                    help='With more than one process, take files as they are lexed rather than in walk order')
+args = parser.parse_args()
 
-for lf in _inst:
-    tok_parser = lp.ParseLexStream(lf.tokens)
-    loguru.logger.info(f"Parsed {len(tok_parser.parsed_tokens)} tokens from file {lf.source.name}.")
-    # _last_ln = 0
-    # for parsed_obj in tok_parser.parsed_tokens:
-    #     print(f"{parsed_obj.token_string}@L{parsed_obj.position[0]}:{parsed_obj.position[1]}",
-    #           end="\n" if parsed_obj.position[0] != _last_ln else "")
-    #     _last_ln = parsed_obj.position[0]
-    # break
+try:
+    _inst = lex.LexFileGenerator(path=os.environ["EVOTING_PATH"], source_file_ext=args.ext, lexer=args.lexer,
+                                 processes=args.processes or None, ordered=not args.as_completed)
+except ClassNotFound:
+    parser.error(f"No lexer called {args.lexer}")
+
+with _inst:
+    for lf in _inst:
+        tok_parser = lp.ParseLexStream(lf.table if lf.table is not None else lf.tokens)
+        loguru.logger.info(f"Parsed {len(tok_parser.parsed_tokens)} tokens from file {lf.source.name}.")
+        # _last_ln = 0
+        # for parsed_obj in tok_parser.parsed_tokens:
+        #     print(f"{parsed_obj.token_string}@L{parsed_obj.position[0]}:{parsed_obj.position[1]}",
+        #           end="\n" if parsed_obj.position[0] != _last_ln else "")
+        #     _last_ln = parsed_obj.position[0]
+        # break